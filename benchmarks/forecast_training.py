@@ -0,0 +1,71 @@
+# author: Emanuele Salonico, 2023
+# Benchmark of the training time per route of the forecast module, on synthetic scraped data.
+# Usage: python benchmarks/forecast_training.py [n_routes] [rows_per_route] [n_jobs]
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from src.google_flight_analysis import forecast
+
+AIRLINES = ["Lufthansa", "ITA", "Eurowings", "Ryanair", "easyJet", "Austrian", "Swiss", "KLM", "Air France", "Vueling"]
+AIRPORTS = ["MUC", "FCO", "FMM", "JFK", "LAX", "CDG", "AMS", "MAD", "VIE", "ZRH"]
+
+
+def synthetic_scraped_df(n_routes, rows_per_route, seed=0):
+    """
+    Returns a DataFrame with the Flight.dataframe schema and a plausible price structure.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_routes * rows_per_route
+
+    route_ids = np.repeat(np.arange(n_routes), rows_per_route)
+    origin = np.array(AIRPORTS)[route_ids % len(AIRPORTS)]
+    destination = np.array(AIRPORTS)[(route_ids // len(AIRPORTS) + route_ids + 1) % len(AIRPORTS)]
+
+    days_advance = rng.integers(1, 120, n)
+    layover_n = rng.integers(0, 3, n)
+    airline_idx = rng.integers(0, len(AIRLINES), n)
+    departure = pd.Timestamp("2023-06-01") + pd.to_timedelta(rng.integers(0, 90, n), unit="D")
+
+    price = 80 + 60 * np.exp(-days_advance / 30) + 25 * layover_n + 5 * airline_idx + rng.normal(0, 10, n)
+
+    return pd.DataFrame({
+        "departure_datetime": departure,
+        "airlines": pd.Series(np.array(AIRLINES, dtype=object)[airline_idx]).map(lambda x: [x]),
+        "travel_time": 90 + 180 * layover_n + rng.integers(0, 60, n),
+        "origin": origin,
+        "destination": destination,
+        "layover_n": layover_n,
+        "price_eur": np.clip(price, 20, None).round(),
+        "price_trend": np.array(["low", "typical", "high"])[rng.integers(0, 3, n)],
+        "price_value": None,
+        "days_advance": days_advance,
+    })
+
+
+if __name__ == "__main__":
+    n_routes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rows_per_route = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    n_jobs = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    df = synthetic_scraped_df(n_routes, rows_per_route)
+    print(f"{len(df)} rows, {n_routes} routes, n_jobs={n_jobs}")
+
+    time_start = datetime.now()
+    models, training_times = forecast.train_route_models(df, n_jobs=n_jobs)
+    time_train = (datetime.now() - time_start).total_seconds()
+
+    time_start = datetime.now()
+    scored = forecast.score(models, df)
+    time_score = (datetime.now() - time_start).total_seconds()
+
+    times = np.array(list(training_times.values()))
+    print(f"training time per route: mean {times.mean():.3f} s - min {times.min():.3f} s - max {times.max():.3f} s")
+    print(f"total training time (wall): {time_train:.2f} s")
+    print(f"batch scoring time: {time_score:.2f} s ({len(df) / time_score:,.0f} rows/s)")
+    print(f"mean absolute error: {scored['price_delta'].abs().mean():.2f} EUR")
@@ -0,0 +1,56 @@
+# author: Emanuele Salonico, 2023
+# Benchmark of the start-up time of the modules and CLI entry points, each measured in a fresh interpreter.
+# Usage: python benchmarks/import_time.py [n_runs]
+
+import os
+import sys
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+TARGETS = {
+    "python (baseline)": "pass",
+    "scrape": "import src.google_flight_analysis.scrape",
+    "flight": "import src.google_flight_analysis.flight",
+    "scheduler": "import src.google_flight_analysis.scheduler",
+    "worker": "import src.google_flight_analysis.worker",
+    "database": "import src.google_flight_analysis.database",
+    "flight_analysis (CLI)": "import flight_analysis",
+    "flight_analysis --help": "import flight_analysis, contextlib, io\n"
+                              "with contextlib.redirect_stdout(io.StringIO()), contextlib.suppress(SystemExit):\n"
+                              "    flight_analysis.main(['--help'])",
+}
+
+# must not be imported by the CLI until a subcommand needs them
+HEAVY_MODULES = ["pandas", "numpy", "selenium", "webdriver_manager", "tqdm", "requests", "psycopg2", "private.private"]
+
+
+def time_code(code, n_runs):
+    """
+    Returns the wall-clock times (seconds) of running code in n_runs fresh interpreters.
+    """
+    times = []
+    for _ in range(n_runs):
+        time_start = datetime.now()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append((datetime.now() - time_start).total_seconds())
+    return times
+
+
+def heavy_modules_loaded(code):
+    """
+    Returns the heavy modules loaded after running code.
+    """
+    check = code + f"\nimport sys\nprint(','.join(x for x in {HEAVY_MODULES!r} if x in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", check], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return out.strip().split("\n")[-1]
+
+
+if __name__ == "__main__":
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    for name, code in TARGETS.items():
+        times = sorted(time_code(code, n_runs))
+        print(f"{name:<25} median {times[len(times) // 2] * 1000:7.1f} ms - min {times[0] * 1000:7.1f} ms"
+              f" - heavy modules: {heavy_modules_loaded(code) or '-'}")
@@ -1,77 +1,326 @@
 # author: Emanuele Salonico, 2023
+# Usage:
+#   python flight_analysis.py [run]                       scrape the routes of config.ini and load them into the database,
+#                                                         then update the fare index, the forecast and the retention rollups
+#   python flight_analysis.py scrape [--output FILE]      scrape the routes of config.ini, save the results to a pickle file (no database)
+#   python flight_analysis.py load FILE [FILE ...]        load pickle files saved by scrape into the database
+#   python flight_analysis.py replay FILE                 parse a page captured by a failed scrape (no browser, no database)
+#   python flight_analysis.py report ORIG DEST DATE_FROM [DATE_TO]
+#                                                         best time to book a route, from the fare index
+#   python flight_analysis.py migrate                     create the database tables, migrating the ones with an old schema
+#   python flight_analysis.py schedule                    run the scheduler, reloading config.ini when it changes
+#   python flight_analysis.py worker                      run a scraping worker (any number, on any host)
+#   python flight_analysis.py enqueue                     add the routes of config.ini to the job queue
+#
+# Heavy dependencies (pandas, numpy, selenium, psycopg2) and the credentials in private/private.py
+# are only imported by the subcommands that need them, so short-lived invocations start fast.
 
 import utils
 import os
+import sys
 
 # logging
 logger_name = os.path.basename(__file__)
 logger = utils.setup_logger(logger_name)
 
-import numpy as np
-import pandas as pd
 from datetime import timedelta, datetime
 import configparser
-
-from src.google_flight_analysis.scrape import Scrape
-from src.google_flight_analysis.database import Database
-import private.private as private
+import argparse
 
 # config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.ini")
 config = configparser.ConfigParser()
-config.read(os.path.join(os.path.dirname(__file__), "config.ini"))
+config.read(CONFIG_PATH)
 
 
-if __name__ == "__main__":
+def connect_db(prepare=True):
+    """
+    Connects to the database configured in private/private.py and creates its tables (migrating
+    the ones with an old schema), if prepare. Otherwise, refuses to go on if a table has an old schema.
+    """
+    import private.private as private
+    from src.google_flight_analysis.database import Database
+
+    db = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table=private.DB_TABLE)
+    if prepare:
+        db.prepare_db_and_tables(overwrite_table=False)
+    elif db.legacy_tables():
+        raise RuntimeError(f"Tables {db.legacy_tables()} have an old schema, run: python flight_analysis.py migrate")
+    return db
+
+
+def scrape_routes():
+    """
+    Scrapes all the route x date combinations of config.ini, returns a DataFrame of the results
+    (None if no scrape succeeded).
+    """
+    import numpy as np
+    import pandas as pd
+    from src.google_flight_analysis.scrape import Scrape, ScrapeError
 
-    # 1. scrape routes
     routes = utils.get_routes_from_config(config)
-    
+
     # compute number of total scrapes
     n_total_scrapes = sum([x[2] for x in routes])
-    
+
     all_results = []
     all_iter_times = []
     n_iter = 1
 
-    # iterate over the routes
+    # all route x date scrapes
+    scrapes = []
     for route in routes:
         origin = route[0]
         destination = route[1]
         date_range = [(datetime.today() + timedelta(days=i+1)) for i in range(route[2])]
         date_range = [date.strftime("%Y-%m-%d") for date in date_range]
 
-        # iterate over dates
-        for i, date in enumerate(date_range):
-            scrape = Scrape(origin, destination, date)
+        for date in date_range:
+            scrapes.append(Scrape(origin, destination, date, backend=config["scrape"]["backend"]))
+
+    if config["scrape"].getboolean("pipelined"):
+        # one driver, loading the next page while the current one is parsed
+        time_start = datetime.now()
+        results = Scrape.run_pipelined(scrapes, queue_size=config["scrape"].getint("queue_size"))
+        time_total = round((datetime.now() - time_start).total_seconds(), 2)
+
+        for scrape, error in results:
+            if error is None:
+                logger.info(f"[{n_iter}/{n_total_scrapes}] Scraped: {scrape.origin} {scrape.dest} {scrape.date_leave} - {scrape.data.shape[0]} results ({scrape.outcome.value}, {scrape.attempts} attempts)")
+                all_results.append(scrape.data)
+            else:
+                logger.error(f"ERROR: {scrape.origin} {scrape.dest} {scrape.date_leave} - {scrape.outcome.value if scrape.outcome else ''} after {scrape.attempts} attempts")
+                logger.error(error)
+            n_iter += 1
+
+        logger.info(f"[{time_total} sec - avg: {round(time_total / max(len(scrapes), 1), 2)}] Pipelined scrape done")
+
+    else:
+        for scrape in scrapes:
+            origin, destination, date = scrape.origin, scrape.dest, scrape.date_leave
 
             try:
                 time_start = datetime.now()
-                
+
                 # run scrape
                 scrape.run_scrape()
-                
+
                 time_end = datetime.now()
 
                 time_iteration = (time_end - time_start).seconds + round(((time_end - time_start).microseconds * 1e-6), 2)
                 all_iter_times.append(time_iteration)
                 avg_iter_time = round(np.array(all_iter_times).mean(), 2)
 
-                logger.info(f"[{n_iter}/{n_total_scrapes}] [{time_iteration} sec - avg: {avg_iter_time}] Scraped: {origin} {destination} {date} - {scrape.data.shape[0]} results")
+                logger.info(f"[{n_iter}/{n_total_scrapes}] [{time_iteration} sec - avg: {avg_iter_time}] Scraped: {origin} {destination} {date} - {scrape.data.shape[0]} results ({scrape.outcome.value}, {scrape.attempts} attempts)")
                 all_results.append(scrape.data)
+            except ScrapeError as e:
+                logger.error(f"ERROR: {origin} {destination} {date} - {e.outcome.value} after {scrape.attempts} attempts")
+                logger.error(e)
             except Exception as e:
                 logger.error(f"ERROR: {origin} {destination} {date}")
                 logger.error(e)
-                
+
             n_iter += 1
 
-    all_results_df = pd.concat(all_results)
+    if not all_results:
+        logger.error("No results scraped.")
+        return None
 
-    # 2. add results to postgresql
-    # connect to database
-    db = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table=private.DB_TABLE)
+    return pd.concat(all_results)
+
+
+def history_source():
+    """
+    Returns the table/view holding the scraped history: None (the scraped table) with full ingest,
+    the daily snapshots view with delta ingest (the scraped table stays empty).
+    """
+    return ("public.scraped_daily" if config["database"]["ingest_mode"] == "delta" else None)
+
+
+def load_results(db, df):
+    """
+    Adds scraped results to the database (full or delta ingest, see config.ini)
+    and updates the fare index with them.
+    """
+    if config["database"]["ingest_mode"] == "delta":
+        db.add_pandas_df_to_db_delta(df)
+    else:
+        db.add_pandas_df_to_db(df)
+
+    db.update_fare_index(df, source=history_source())
+
+
+def cmd_run(args):
+    # database first: a schema problem must not waste a whole scrape
+    db = connect_db()
+
+    # 1. scrape routes
+    all_results_df = scrape_routes()
+    if all_results_df is None:
+        return 1
+
+    # 2. add results to postgresql, 3. update the fare index with the new results
+    load_results(db, all_results_df)
+
+    # 4. forecast: (re)train the route models on the scraped history and score the new results
+    from src.google_flight_analysis import forecast
+
+    models_path = config["forecast"]["models_path"]
+    if config["forecast"].getboolean("retrain"):
+        history_df = db.get_scraped_df(days=config["forecast"].getint("history_days"), source=history_source())
+        models, training_times = forecast.train_route_models(history_df)
+        forecast.save_models(models, models_path)
+
+    if os.path.isfile(models_path):
+        scored_df = forecast.score(forecast.load_models(models_path), all_results_df)
+        best_deals = scored_df.nsmallest(5, "price_delta")
+        for _, row in best_deals.iterrows():
+            logger.info(f"Deal: {row.origin} {row.destination} {row.departure_datetime} - {row.price_eur} EUR (forecast: {round(row.price_forecast)} EUR)")
+
+    # 5. retention: roll up the old scraped rows into daily summaries
+    if config["retention"].getboolean("enabled"):
+        db.rollup_scraped(config["retention"].getint("raw_days"), archive_folder=config["retention"]["archive_folder"] or None)
+
+    return 0
+
+
+def cmd_scrape(args):
+    all_results_df = scrape_routes()
+    if all_results_df is None:
+        return 1
+
+    output = args.output or os.path.join("outputs", datetime.now().strftime("%y%m%d_%H%M%S") + "_results.pkl")
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+
+    all_results_df.to_pickle(output)
+    logger.info(f"{all_results_df.shape[0]} results saved to {output}")
+    return 0
 
-    # prepare database and tables
-    db.prepare_db_and_tables(overwrite_table=False)
 
-    # add results to database
-    db.add_pandas_df_to_db(all_results_df)
+def cmd_load(args):
+    import pandas as pd
+
+    db = connect_db()
+    for filepath in args.files:
+        df = pd.read_pickle(filepath)
+        logger.info(f"Loading {filepath} ({df.shape[0]} results)")
+        load_results(db, df)
+    return 0
+
+
+def cmd_replay(args):
+    from src.google_flight_analysis.scrape import Scrape, ScrapeError
+
+    try:
+        scrape = Scrape.replay(args.file)
+    except ScrapeError as e:
+        logger.error(f"ERROR: {args.file} - {e.outcome.value}")
+        logger.error(e)
+        return 1
+
+    print(scrape.data.to_string())
+    return 0
+
+
+def cmd_report(args):
+    db = connect_db(prepare=False)
+    print(db.best_time_to_book(args.origin, args.destination, args.date_from, args.date_to).to_string(index=False))
+    return 0
+
+
+def cmd_migrate(args):
+    # tables with an old schema are migrated by prepare_db_and_tables
+    connect_db()
+    logger.info("Database schema up to date.")
+    return 0
+
+
+def cmd_schedule(args):
+    from src.google_flight_analysis.scheduler import Scheduler
+
+    db = connect_db()
+
+    def on_results(df):
+        load_results(db, df)
+
+    # run until stopped, reloading config.ini when it changes
+    scheduler = Scheduler(CONFIG_PATH, on_results=on_results)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Scheduler stopped.")
+    return 0
+
+
+def cmd_worker(args):
+    from src.google_flight_analysis.worker import Worker
+
+    db = connect_db(prepare=False)
+
+    def on_results(df):
+        load_results(db, df)
+
+    worker = Worker(db, on_results, backend=config["scrape"]["backend"])
+    try:
+        worker.run(max_jobs=args.max_jobs, stop_when_empty=args.stop_when_empty)
+    except KeyboardInterrupt:
+        logger.info(f"{worker} stopped.")
+    return 0
+
+
+def cmd_enqueue(args):
+    from src.google_flight_analysis.worker import jobs_from_routes
+
+    db = connect_db()
+    db.enqueue_jobs(jobs_from_routes(utils.get_routes_from_config(config)))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="flight_analysis.py", description="Google Flights scraping and analysis.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("run", help="scrape, load into the database, update fare index, forecast and rollups (default)").set_defaults(func=cmd_run)
+
+    p = subparsers.add_parser("scrape", help="scrape the routes of config.ini to a pickle file, without database")
+    p.add_argument("--output", help="output file (default: outputs/{yymmdd_HHMMSS}_results.pkl)")
+    p.set_defaults(func=cmd_scrape)
+
+    p = subparsers.add_parser("load", help="load pickle files saved by scrape into the database")
+    p.add_argument("files", nargs="+")
+    p.set_defaults(func=cmd_load)
+
+    p = subparsers.add_parser("replay", help="parse a page captured by a failed scrape")
+    p.add_argument("file")
+    p.set_defaults(func=cmd_replay)
+
+    p = subparsers.add_parser("report", help="best time to book a route, from the fare index")
+    p.add_argument("origin")
+    p.add_argument("destination")
+    p.add_argument("date_from", help="YYYY-MM-DD")
+    p.add_argument("date_to", nargs="?", help="YYYY-MM-DD (default: date_from)")
+    p.set_defaults(func=cmd_report)
+
+    subparsers.add_parser("migrate", help="create the database tables, migrating the ones with an old schema").set_defaults(func=cmd_migrate)
+
+    subparsers.add_parser("schedule", help="run the scheduler").set_defaults(func=cmd_schedule)
+
+    p = subparsers.add_parser("worker", help="run a scraping worker on the job queue")
+    p.add_argument("--max-jobs", type=int, default=None)
+    p.add_argument("--stop-when-empty", action="store_true")
+    p.set_defaults(func=cmd_worker)
+
+    subparsers.add_parser("enqueue", help="add the routes of config.ini to the job queue").set_defaults(func=cmd_enqueue)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    func = getattr(args, "func", cmd_run)
+    return func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# author: Emanuele Salonico, 2023
+# Same as: python flight_analysis.py schedule
+
+import sys
+
+from flight_analysis import main
+
+
+if __name__ == "__main__":
+    sys.exit(main(["schedule"]))
@@ -0,0 +1,12 @@
+# author: Emanuele Salonico, 2023
+# Usage (same as: python flight_analysis.py worker / enqueue):
+#   python run_worker.py            run a scraping worker (any number, on any host)
+#   python run_worker.py enqueue    add the routes of config.ini to the job queue
+
+import sys
+
+from flight_analysis import main
+
+
+if __name__ == "__main__":
+    sys.exit(main(["enqueue"] if sys.argv[1:2] == ["enqueue"] else ["worker"]))
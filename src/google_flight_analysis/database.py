@@ -3,22 +3,40 @@
 import psycopg2
 import pandas as pd
 import numpy as np
-import ast
 import psycopg2.extras as extras
+import json
 import os
 import logging
 
+from src.google_flight_analysis.validation import validate_scraped, write_quarantine_file
+
 # logging
 logger_name = os.path.basename(__file__)
 logger = logging.getLogger(logger_name)
 
 
 class Database:
+    # columns identifying a flight, and columns whose changes are stored, in the delta table
+    DELTA_KEY_COLUMNS = ["origin", "destination", "departure_datetime", "arrival_datetime", "airline_ids", "one_way"]
+    DELTA_STATE_COLUMNS = ["travel_time", "layover_n", "layover_time", "layover_location_ids",
+                           "price_eur", "price_trend", "price_value", "has_train"]
+
+    # lower bounds (in days) of the days in advance buckets used by the fare index
+    DAYS_ADVANCE_BUCKETS = [0, 7, 14, 21, 30, 45, 60, 90, 120, 180]
+
+    # ids of the dimension tables resolved so far in this process, per database: {(host, db): {table: {name: id}}}
+    _dimension_ids = {}
+
+    # columns replaced by dimension ids (see migrate_to_dimension_ids)
+    LEGACY_COLUMNS = ["airlines", "layover_location"]
+
     def __init__(self, db_host, db_name, db_user, db_pw, db_table):
         self.db_host = db_host
         self.db_name = db_name
         self.db_user = db_user
         self.db_table = db_table
+        self.jobs_table = "public.scrape_jobs"
+        self.rollup_table = "public.scraped_rollup_daily"
         self.__db_pw = db_pw
 
         self.conn = self.connect_to_postgresql()
@@ -80,13 +98,13 @@ class Database:
                 id uuid DEFAULT gen_random_uuid() PRIMARY KEY,
                 departure_datetime timestamp with time zone,
                 arrival_datetime timestamp with time zone,
-                airlines text[] COLLATE pg_catalog."default",
+                airline_ids smallint[],
                 travel_time smallint NOT NULL,
                 origin character(3) COLLATE pg_catalog."default"  NOT NULL,
                 destination character(3) COLLATE pg_catalog."default"  NOT NULL,
                 layover_n smallint NOT NULL,
                 layover_time numeric,
-                layover_location text COLLATE pg_catalog."default",
+                layover_location_ids smallint[],
                 price_eur smallint NOT NULL,
                 price_trend text COLLATE pg_catalog."default",
                 price_value text COLLATE pg_catalog."default",
@@ -99,36 +117,443 @@ class Database:
             TABLESPACE pg_default;
 
             ALTER TABLE IF EXISTS public.scraped OWNER to postgres;
+
+            CREATE INDEX IF NOT EXISTS scraped_airline_ids_idx
+                ON public.scraped USING gin (airline_ids);
             """
             
         cursor = self.conn.cursor()
         cursor.execute(query)
         cursor.close()
 
+    def create_fare_index_table(self, overwrite):
+        """
+        Creates the fare index table: one row per (route, departure date, days in advance bucket)
+        with the price statistics of all the scraped flights falling in it.
+        """
+        query = ""
+        if overwrite:
+            query += "DROP TABLE IF EXISTS public.fare_index;\n"
+
+        query += f"""
+            CREATE TABLE IF NOT EXISTS public.fare_index
+            (
+                origin character(3) COLLATE pg_catalog."default" NOT NULL,
+                destination character(3) COLLATE pg_catalog."default" NOT NULL,
+                departure_date date NOT NULL,
+                days_advance_bucket smallint NOT NULL,
+                n_observations integer NOT NULL,
+                price_min smallint NOT NULL,
+                price_median numeric NOT NULL,
+                price_p90 numeric NOT NULL,
+                best_airline text COLLATE pg_catalog."default",
+                updated_at timestamp with time zone NOT NULL DEFAULT now(),
+                PRIMARY KEY (origin, destination, departure_date, days_advance_bucket)
+            )
+
+            TABLESPACE pg_default;
+
+            ALTER TABLE IF EXISTS public.fare_index OWNER to postgres;
+
+            CREATE INDEX IF NOT EXISTS scraped_route_departure_idx
+                ON {self.db_table} (origin, destination, departure_datetime);
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def create_scraped_delta_table(self, overwrite):
+        """
+        Creates the delta table, which stores only new flights and changes of their fares:
+        each row is a state of a flight, valid from valid_from until valid_to (null: current state),
+        last observed at last_seen.
+        Also creates the scraped_daily view, which rebuilds the daily snapshots from it.
+        """
+        query = ""
+        if overwrite:
+            query += "DROP TABLE IF EXISTS public.scraped_delta CASCADE;\n"
+
+        query += """
+            CREATE TABLE IF NOT EXISTS public.scraped_delta
+            (
+                id uuid DEFAULT gen_random_uuid() PRIMARY KEY,
+                departure_datetime timestamp with time zone NOT NULL,
+                arrival_datetime timestamp with time zone NOT NULL,
+                airline_ids smallint[],
+                travel_time smallint NOT NULL,
+                origin character(3) COLLATE pg_catalog."default"  NOT NULL,
+                destination character(3) COLLATE pg_catalog."default"  NOT NULL,
+                layover_n smallint NOT NULL,
+                layover_time numeric,
+                layover_location_ids smallint[],
+                price_eur smallint NOT NULL,
+                price_trend text COLLATE pg_catalog."default",
+                price_value text COLLATE pg_catalog."default",
+                one_way boolean NOT NULL,
+                has_train boolean NOT NULL,
+                valid_from timestamp with time zone NOT NULL,
+                valid_to timestamp with time zone,
+                last_seen timestamp with time zone NOT NULL
+            )
+
+            TABLESPACE pg_default;
+
+            ALTER TABLE IF EXISTS public.scraped_delta OWNER to postgres;
+
+            -- same key expressions as the delta ingest joins (airline_ids through coalesce), so that they can use it
+            DROP INDEX IF EXISTS public.scraped_delta_current_idx;
+            CREATE UNIQUE INDEX IF NOT EXISTS scraped_delta_current_key_idx
+                ON public.scraped_delta (origin, destination, departure_datetime, arrival_datetime,
+                    (coalesce(airline_ids, '{}'::smallint[])), one_way)
+                WHERE valid_to IS NULL;
+
+            CREATE INDEX IF NOT EXISTS scraped_delta_airline_ids_idx
+                ON public.scraped_delta USING gin (airline_ids);
+
+            CREATE OR REPLACE VIEW public.scraped_daily AS
+                SELECT d.snapshot_date::date AS snapshot_date,
+                    s.departure_datetime, s.arrival_datetime, s.airline_ids, s.travel_time, s.origin, s.destination,
+                    s.layover_n, s.layover_time, s.layover_location_ids, s.price_eur, s.price_trend, s.price_value,
+                    s.one_way, s.has_train,
+                    (s.departure_datetime::date - d.snapshot_date::date) AS days_advance
+                FROM public.scraped_delta s
+                CROSS JOIN LATERAL generate_series(s.valid_from::date, s.last_seen::date, interval '1 day') AS d(snapshot_date)
+                WHERE s.valid_to IS NULL OR d.snapshot_date::date < s.valid_to::date;
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def create_jobs_table(self, overwrite):
+        """
+        Creates the job queue used by distributed workers: one row per route x date to scrape.
+        A running job is leased to a worker until lease_expires_at, which the worker extends with heartbeats.
+        """
+        query = ""
+        if overwrite:
+            query += f"DROP TABLE IF EXISTS {self.jobs_table};\n"
+
+        query += f"""
+            CREATE TABLE IF NOT EXISTS {self.jobs_table}
+            (
+                id bigserial PRIMARY KEY,
+                origin character(3) COLLATE pg_catalog."default" NOT NULL,
+                destination character(3) COLLATE pg_catalog."default" NOT NULL,
+                date_leave date NOT NULL,
+                date_return date,
+                priority smallint NOT NULL DEFAULT 0,
+                status text COLLATE pg_catalog."default" NOT NULL DEFAULT 'pending',
+                attempts smallint NOT NULL DEFAULT 0,
+                max_attempts smallint NOT NULL DEFAULT 3,
+                worker_id text COLLATE pg_catalog."default",
+                lease_expires_at timestamp with time zone,
+                heartbeat_at timestamp with time zone,
+                run_after timestamp with time zone NOT NULL DEFAULT now(),
+                enqueued_at timestamp with time zone NOT NULL DEFAULT now(),
+                finished_at timestamp with time zone,
+                n_results integer,
+                error text COLLATE pg_catalog."default"
+            )
+
+            TABLESPACE pg_default;
+
+            CREATE INDEX IF NOT EXISTS scrape_jobs_claim_idx
+                ON {self.jobs_table} (status, priority DESC, run_after);
+
+            CREATE UNIQUE INDEX IF NOT EXISTS scrape_jobs_open_idx
+                ON {self.jobs_table} (origin, destination, date_leave, (coalesce(date_return, '-infinity'::date)))
+                WHERE status IN ('pending', 'running');
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def create_dimension_tables(self):
+        """
+        Creates the airlines and airports dimension tables (small integer id for each name/code),
+        referenced by the id arrays of the scraped rows, and the functions mapping ids back to names.
+        """
+        query = """
+            CREATE TABLE IF NOT EXISTS public.airlines
+            (
+                id smallserial PRIMARY KEY,
+                name text COLLATE pg_catalog."default" NOT NULL UNIQUE
+            );
+
+            CREATE TABLE IF NOT EXISTS public.airports
+            (
+                id smallserial PRIMARY KEY,
+                code text COLLATE pg_catalog."default" NOT NULL UNIQUE
+            );
+
+            CREATE OR REPLACE FUNCTION public.airline_names(ids smallint[]) RETURNS text[] AS $$
+                SELECT array_agg(a.name ORDER BY u.ord)
+                FROM unnest(ids) WITH ORDINALITY AS u(id, ord) JOIN public.airlines a ON a.id = u.id;
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION public.airport_codes(ids smallint[]) RETURNS text[] AS $$
+                SELECT array_agg(a.code ORDER BY u.ord)
+                FROM unnest(ids) WITH ORDINALITY AS u(id, ord) JOIN public.airports a ON a.id = u.id;
+            $$ LANGUAGE sql STABLE;
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def legacy_tables(self):
+        """
+        Returns the tables (scraped and delta tables) still having the old schema
+        (airlines text[], layover_location text), to be migrated with migrate_to_dimension_ids.
+        """
+        query = """
+            SELECT DISTINCT table_schema || '.' || table_name FROM information_schema.columns
+            WHERE table_schema || '.' || table_name = ANY(%s) AND column_name = ANY(%s);
+        """
+
+        tables = [(self.db_table if "." in self.db_table else "public." + self.db_table), "public.scraped_delta"]
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, (tables, Database.LEGACY_COLUMNS))
+        result = cursor.fetchall()
+        cursor.close()
+
+        return sorted(x[0] for x in result)
+
+    def migrate_to_dimension_ids(self, table=None):
+        """
+        Converts a table (default: the scraped table) created with the old schema
+        (airlines text[], layover_location text) to dimension ids (airline_ids smallint[], layover_location_ids smallint[]).
+        Returns True if the migration succeeded.
+        """
+        table = table or self.db_table
+
+        # the daily view depends on the old columns: it is created again by create_scraped_delta_table
+        drop_view = ("DROP VIEW IF EXISTS public.scraped_daily;" if table == "public.scraped_delta" else "")
+
+        query = f"""
+            BEGIN;
+
+            {drop_view}
+
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS airline_ids smallint[],
+                ADD COLUMN IF NOT EXISTS layover_location_ids smallint[];
+
+            -- names may still be quoted by the old array conversion
+            INSERT INTO public.airlines (name)
+                SELECT DISTINCT btrim(u.name, ' ' || chr(39)) FROM {table}, unnest(airlines) AS u(name)
+                ON CONFLICT (name) DO NOTHING;
+
+            INSERT INTO public.airports (code)
+                SELECT DISTINCT btrim(u.code) FROM {table}, unnest(string_to_array(layover_location, ',')) AS u(code)
+                ON CONFLICT (code) DO NOTHING;
+
+            UPDATE {table} s SET
+                airline_ids = ARRAY(
+                    SELECT a.id FROM unnest(s.airlines) WITH ORDINALITY AS u(name, ord)
+                    JOIN public.airlines a ON a.name = btrim(u.name, ' ' || chr(39)) ORDER BY u.ord),
+                layover_location_ids = ARRAY(
+                    SELECT a.id FROM unnest(string_to_array(s.layover_location, ',')) WITH ORDINALITY AS u(code, ord)
+                    JOIN public.airports a ON a.code = btrim(u.code) ORDER BY u.ord)
+            WHERE s.airline_ids IS NULL;
+
+            UPDATE {table} SET layover_location_ids = NULL WHERE cardinality(layover_location_ids) = 0;
+
+            ALTER TABLE {table} DROP COLUMN airlines, DROP COLUMN layover_location;
+
+            CREATE INDEX IF NOT EXISTS {table.split(".")[-1]}_airline_ids_idx ON {table} USING gin (airline_ids);
+
+            COMMIT;
+            """
+
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query)
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error("Error: %s" % error)
+            cursor.execute("ROLLBACK;")
+            cursor.close()
+            return False
+
+        logger.info("Table [{}] migrated to dimension ids".format(table))
+        cursor.close()
+        return True
+
+    def create_quarantine_table(self, overwrite):
+        """
+        Creates the quarantine table, where rows failing validation are stored (as json) with the reason.
+        """
+        query = ""
+        if overwrite:
+            query += "DROP TABLE IF EXISTS public.scraped_quarantine;\n"
+
+        query += """
+            CREATE TABLE IF NOT EXISTS public.scraped_quarantine
+            (
+                id uuid DEFAULT gen_random_uuid() PRIMARY KEY,
+                quarantined_at timestamp with time zone NOT NULL DEFAULT now(),
+                reason text COLLATE pg_catalog."default" NOT NULL,
+                data jsonb NOT NULL
+            )
+
+            TABLESPACE pg_default;
+
+            ALTER TABLE IF EXISTS public.scraped_quarantine OWNER to postgres;
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def create_rollup_tables(self, overwrite):
+        """
+        Creates the rollup table, with the daily summaries of the scraped rows past the retention age
+        (one row per access day and flight: price statistics and number of observations),
+        and the retention state table, with the last access day rolled up for each source table.
+        """
+        query = ""
+        if overwrite:
+            query += f"DROP TABLE IF EXISTS {self.rollup_table};\n"
+
+        query += f"""
+            CREATE TABLE IF NOT EXISTS {self.rollup_table}
+            (
+                access_day date NOT NULL,
+                origin character(3) COLLATE pg_catalog."default" NOT NULL,
+                destination character(3) COLLATE pg_catalog."default" NOT NULL,
+                departure_datetime timestamp with time zone,
+                arrival_datetime timestamp with time zone,
+                airline_ids smallint[],
+                layover_n smallint NOT NULL,
+                one_way boolean NOT NULL,
+                days_advance smallint NOT NULL,
+                n_observations integer NOT NULL,
+                price_min smallint NOT NULL,
+                price_median numeric NOT NULL,
+                price_max smallint NOT NULL
+            )
+
+            TABLESPACE pg_default;
+
+            CREATE INDEX IF NOT EXISTS scraped_rollup_daily_route_departure_idx
+                ON {self.rollup_table} (origin, destination, departure_datetime);
+
+            CREATE TABLE IF NOT EXISTS public.retention_state
+            (
+                source_table text COLLATE pg_catalog."default" PRIMARY KEY,
+                rolled_up_until date NOT NULL,
+                updated_at timestamp with time zone NOT NULL DEFAULT now()
+            );
+
+            CREATE INDEX IF NOT EXISTS scraped_access_date_idx
+                ON {self.db_table} (access_date);
+            """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        cursor.close()
+
     def prepare_db_and_tables(self, overwrite_table=False):
         # create database
         if self.db_name not in self.list_all_databases():
             self.create_db()
 
-        # create table
+        # create tables
+        self.create_dimension_tables()
+
+        # tables with the old schema are migrated first: their new columns are needed by the indexes and inserts below
+        for table in self.legacy_tables():
+            if not self.migrate_to_dimension_ids(table):
+                raise RuntimeError(f"Table [{table}] could not be migrated to dimension ids, see the log.")
+
         self.create_scraped_table(overwrite_table)
+        self.create_scraped_delta_table(overwrite_table)
+        self.create_fare_index_table(overwrite_table)
+        self.create_jobs_table(overwrite_table)
+        self.create_quarantine_table(overwrite_table)
+        self.create_rollup_tables(overwrite_table)
         
+    def resolve_dimension_ids(self, table, column, values):
+        """
+        Returns a dictionary {name: id} for the names in values, from a dimension table
+        (airlines or airports). Names not in the table yet are added to it, in bulk.
+        Resolved ids are cached in the process.
+        """
+        cache = Database._dimension_ids.setdefault((self.db_host, self.db_name), {"airlines": {}, "airports": {}})[table]
+        missing = [x for x in set(values) if x not in cache]
+
+        if missing:
+            cursor = self.conn.cursor()
+            cursor.execute(f"""
+                INSERT INTO public.{table} ({column}) SELECT unnest(%s::text[]) ON CONFLICT ({column}) DO NOTHING;
+                SELECT id, {column} FROM public.{table} WHERE {column} = ANY(%s::text[]);
+            """, (missing, missing))
+            cache.update({name: id for id, name in cursor.fetchall()})
+            cursor.close()
+
+        return {x: cache[x] for x in values}
+
     def transform_and_clean_df(self, df):
         """
         Some necessary cleaning and transforming operations to the df
-        before sending its content to the database
+        before sending its content to the database.
+        Airlines and layover locations are replaced by arrays of dimension ids,
+        resolved once per distinct value.
         """
 
-        df["airlines"] = df.airlines.apply(lambda x: np.array(ast.literal_eval(str(x).replace("[", '"{').replace("]", '}"'))))
+        # airlines: ("Lufthansa", "Swiss") --> airline_ids
+        airlines = df["airlines"].map(lambda x: tuple(x) if isinstance(x, (tuple, list)) else None)
+        distinct_airlines = airlines.dropna().unique()
+        ids = self.resolve_dimension_ids("airlines", "name", [name for x in distinct_airlines for name in x])
+        airline_ids = {x: [ids[name] for name in x] for x in distinct_airlines}
+        df["airline_ids"] = airlines.map(lambda x: airline_ids.get(x))
+
+        # layover locations: "ZRH" or "BER, JFK" --> layover_location_ids
+        distinct_locations = df["layover_location"].dropna().unique()
+        ids = self.resolve_dimension_ids("airports", "code", [code for x in distinct_locations for code in x.split(", ")])
+        location_ids = {x: [ids[code] for code in x.split(", ")] for x in distinct_locations}
+        df["layover_location_ids"] = df["layover_location"].map(lambda x: location_ids.get(x))
+
+        df = df.drop(columns=["airlines", "layover_location"])
         df['layover_time'] = df['layover_time'].fillna(-1)
-        df["layover_location"] = df["layover_location"].fillna(np.nan).replace([np.nan], [None])
         df["price_value"] = df["price_value"].fillna(np.nan).replace([np.nan], [None])
 
         return df
         
+    def add_quarantine_rows(self, invalid_df):
+        """
+        Stores rows that failed validation in the quarantine table
+        (or in a quarantine file, if that fails).
+        """
+        if invalid_df.empty:
+            return
+
+        records = json.loads(invalid_df.drop(columns=["reason"]).to_json(orient="records", date_format="iso"))
+        tuples = [(reason, extras.Json(record)) for reason, record in zip(invalid_df["reason"], records)]
+
+        cursor = self.conn.cursor()
+        try:
+            extras.execute_values(cursor, "INSERT INTO public.scraped_quarantine (reason, data) VALUES %s", tuples)
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error("Error: %s" % error)
+            cursor.close()
+            write_quarantine_file(invalid_df)
+            return
+
+        logger.info("{} rows added to table [scraped_quarantine]".format(len(tuples)))
+        cursor.close()
+
     def add_pandas_df_to_db(self, df):
-        # clean df
-        df = self.transform_and_clean_df(df)
+        # invalid rows are quarantined, so that they don't make the whole batch fail
+        df, invalid_df = validate_scraped(df)
+        self.add_quarantine_rows(invalid_df)
+
+        # clean df (on a copy, the caller's df is left untouched)
+        df = self.transform_and_clean_df(df.copy())
         
         # Create a list of tuples from the dataframe values
         tuples = [tuple(x) for x in df.to_numpy()]
@@ -162,4 +587,451 @@ class Database:
             ALTER COLUMN layover_time TYPE smallint;
         """
         cursor.execute(query)
-        cursor.close()
\ No newline at end of file
+        cursor.close()
+
+    @staticmethod
+    def _delta_key_sql(alias, column):
+        """
+        SQL expression of a key column of the delta table. All the key columns are NOT NULL
+        but airline_ids, compared through coalesce (as in scraped_delta_current_key_idx).
+        """
+        if column == "airline_ids":
+            return f"coalesce({alias}.airline_ids, '{{}}'::smallint[])"
+        return f"{alias}.{column}"
+
+    def add_pandas_df_to_db_delta(self, df):
+        """
+        Delta ingest: compares the rows of df with the current state of each flight in the delta table.
+        Unchanged flights only get their last_seen updated, changed flights get their current state
+        closed (valid_to) and a new state inserted, new flights are inserted.
+        """
+        # invalid rows are quarantined, so that they don't make the whole batch fail
+        df, invalid_df = validate_scraped(df, not_null_columns=["departure_datetime", "arrival_datetime"])
+        self.add_quarantine_rows(invalid_df)
+
+        # clean df (on a copy, the caller's df is left untouched)
+        df = self.transform_and_clean_df(df.copy())
+
+        cols = Database.DELTA_KEY_COLUMNS + Database.DELTA_STATE_COLUMNS
+        tuples = [tuple(x) for x in df[cols + ["access_date"]].to_numpy()]
+
+        # plain equality, so that the joins can use hash joins and scraped_delta_current_key_idx
+        key_match = " AND ".join(f"{Database._delta_key_sql('d', x)} = {Database._delta_key_sql('i', x)}"
+                                 for x in Database.DELTA_KEY_COLUMNS)
+        key_partition = ", ".join(Database._delta_key_sql("i", x) for x in Database.DELTA_KEY_COLUMNS)
+        state_changed = " OR ".join(f"d.{x} IS DISTINCT FROM i.{x}" for x in Database.DELTA_STATE_COLUMNS)
+
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN;")
+            cursor.execute(f"""
+                CREATE TEMPORARY TABLE scraped_incoming ON COMMIT DROP AS
+                SELECT {",".join(cols)}, valid_from AS access_date FROM public.scraped_delta WITH NO DATA;
+            """)
+            extras.execute_values(cursor, "INSERT INTO scraped_incoming({}) VALUES %s".format(",".join(cols + ["access_date"])), tuples)
+            cursor.execute("UPDATE scraped_incoming SET layover_time = NULL WHERE layover_time = -1;")
+
+            # the same flight can appear more than once in a batch: keep its last observation
+            cursor.execute(f"""
+                DELETE FROM scraped_incoming WHERE ctid IN (
+                    SELECT ctid FROM (
+                        SELECT i.ctid, row_number() OVER (PARTITION BY {key_partition} ORDER BY i.ctid DESC) AS n
+                        FROM scraped_incoming i) AS x
+                    WHERE x.n > 1);
+            """)
+            cursor.execute("ANALYZE scraped_incoming;")
+
+            # unchanged flights
+            cursor.execute(f"""
+                UPDATE public.scraped_delta d SET last_seen = i.access_date
+                FROM scraped_incoming i
+                WHERE {key_match} AND d.valid_to IS NULL AND NOT ({state_changed});
+            """)
+            n_unchanged = cursor.rowcount
+
+            # changed flights: close their current state
+            cursor.execute(f"""
+                UPDATE public.scraped_delta d SET valid_to = i.access_date
+                FROM scraped_incoming i
+                WHERE {key_match} AND d.valid_to IS NULL AND ({state_changed});
+            """)
+            n_changed = cursor.rowcount
+
+            # new flights and new states of changed flights
+            cursor.execute(f"""
+                INSERT INTO public.scraped_delta ({",".join(cols)}, valid_from, valid_to, last_seen)
+                SELECT {",".join("i." + x for x in cols)}, i.access_date, NULL, i.access_date
+                FROM scraped_incoming i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM public.scraped_delta d WHERE {key_match} AND d.valid_to IS NULL);
+            """)
+            n_inserted = cursor.rowcount
+
+            cursor.execute("COMMIT;")
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error("Error: %s" % error)
+            cursor.execute("ROLLBACK;")
+            cursor.close()
+            return
+
+        logger.info("{} rows added to table [scraped_delta] ({} changed, {} unchanged)".format(n_inserted, n_changed, n_unchanged))
+        cursor.close()
+
+    def _days_advance_bucket_sql(self, column):
+        """
+        SQL expression mapping a days in advance column to the lower bound of its bucket.
+        """
+        buckets = "ARRAY[{}]".format(",".join(str(x) for x in Database.DAYS_ADVANCE_BUCKETS))
+        return f"({buckets})[width_bucket({column}, {buckets})]"
+
+    @staticmethod
+    def fare_index_keys(df, calendar_days=False):
+        """
+        Returns the (origin, destination, departure_date, days_advance_bucket) fare index entries touched by df.
+        Days in advance are taken from df (as in the scraped table) or, if calendar_days, counted
+        as calendar days between access and departure (as in the scraped_daily view).
+        """
+        buckets = np.array(Database.DAYS_ADVANCE_BUCKETS)
+        departure = pd.to_datetime(df["departure_datetime"])
+
+        if calendar_days:
+            days_advance = (departure.dt.normalize() - pd.to_datetime(df["access_date"]).dt.normalize()).dt.days.to_numpy()
+        else:
+            days_advance = df["days_advance"].to_numpy()
+        valid = days_advance >= buckets[0]
+
+        return pd.DataFrame({
+            "origin": df["origin"].to_numpy()[valid],
+            "destination": df["destination"].to_numpy()[valid],
+            "departure_date": departure.dt.date.to_numpy()[valid],
+            "days_advance_bucket": buckets[np.searchsorted(buckets, days_advance[valid], side="right") - 1],
+        }).drop_duplicates()
+
+    def update_fare_index(self, df, source=None):
+        """
+        Updates the fare index with the rows of df, which have just been added to the database.
+        Only the (route, departure date, days in advance bucket) entries touched by df
+        are recomputed, from the rows belonging to them in source (default: the scraped table,
+        use "public.scraped_daily" with delta ingest).
+        """
+        source = source or self.db_table
+        if df.empty:
+            return
+
+        keys = Database.fare_index_keys(df, calendar_days=(source != self.db_table))
+        tuples = [tuple(x) for x in keys.to_numpy()]
+        bucket = self._days_advance_bucket_sql("s.days_advance")
+
+        query = f"""
+            INSERT INTO public.fare_index (origin, destination, departure_date, days_advance_bucket,
+                n_observations, price_min, price_median, price_p90, best_airline, updated_at)
+            SELECT k.origin, k.destination, k.departure_date, k.days_advance_bucket,
+                count(*),
+                min(s.price_eur),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY s.price_eur),
+                percentile_cont(0.9) WITHIN GROUP (ORDER BY s.price_eur),
+                (array_agg(array_to_string(public.airline_names(s.airline_ids), ', ') ORDER BY s.price_eur))[1],
+                now()
+            FROM (VALUES %s) AS k(origin, destination, departure_date, days_advance_bucket)
+            JOIN {source} s
+                ON s.origin = k.origin
+                AND s.destination = k.destination
+                AND s.departure_datetime >= k.departure_date
+                AND s.departure_datetime < k.departure_date + 1
+                AND {bucket} = k.days_advance_bucket
+            GROUP BY k.origin, k.destination, k.departure_date, k.days_advance_bucket
+            ON CONFLICT (origin, destination, departure_date, days_advance_bucket) DO UPDATE SET
+                n_observations = EXCLUDED.n_observations,
+                price_min = EXCLUDED.price_min,
+                price_median = EXCLUDED.price_median,
+                price_p90 = EXCLUDED.price_p90,
+                best_airline = EXCLUDED.best_airline,
+                updated_at = EXCLUDED.updated_at
+        """
+
+        cursor = self.conn.cursor()
+        try:
+            extras.execute_values(cursor, query, tuples, template="(%s, %s, %s::date, %s::smallint)")
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error("Error: %s" % error)
+            self.conn.rollback()
+            cursor.close()
+            return
+
+        logger.info("{} entries updated in table [fare_index]".format(len(tuples)))
+        cursor.close()
+
+    def get_fare_index(self, origin, destination, date_from, date_to=None):
+        """
+        Returns the fare index entries for a route and a range of departure dates (inclusive).
+        """
+        date_to = date_to or date_from
+        query = """
+            SELECT * FROM public.fare_index
+            WHERE origin = %s AND destination = %s AND departure_date BETWEEN %s AND %s
+            ORDER BY departure_date, days_advance_bucket;
+        """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, (origin, destination, date_from, date_to))
+        result = pd.DataFrame(cursor.fetchall(), columns=[x[0] for x in cursor.description])
+        cursor.close()
+
+        return result
+
+    def best_time_to_book(self, origin, destination, date_from, date_to=None):
+        """
+        Returns, for a route and a range of departure dates (inclusive), the price statistics
+        per days in advance bucket, cheapest (by median price) first.
+        E.g. "when should I book MUC->FCO for June":
+        db.best_time_to_book("MUC", "FCO", "2023-06-01", "2023-06-30")
+        """
+        date_to = date_to or date_from
+        query = """
+            SELECT days_advance_bucket,
+                sum(n_observations) AS n_observations,
+                min(price_min) AS price_min,
+                round(avg(price_median), 2) AS price_median,
+                round(avg(price_p90), 2) AS price_p90,
+                (array_agg(best_airline ORDER BY price_min))[1] AS best_airline
+            FROM public.fare_index
+            WHERE origin = %s AND destination = %s AND departure_date BETWEEN %s AND %s
+            GROUP BY days_advance_bucket
+            ORDER BY price_median, days_advance_bucket;
+        """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, (origin, destination, date_from, date_to))
+        result = pd.DataFrame(cursor.fetchall(), columns=[x[0] for x in cursor.description])
+        cursor.close()
+
+        return result
+
+    def get_scraped_df(self, days=None, source=None):
+        """
+        Returns the scraped rows as a DataFrame (Flight.dataframe schema, with airline names
+        and layover locations resolved from their ids), optionally limited to the ones accessed in the last days.
+        Rows are read from source (default: the scraped table, use "public.scraped_daily" with delta ingest,
+        where the access day is the snapshot_date).
+        """
+        source = source or self.db_table
+        date_column = ("access_date" if source == self.db_table else "snapshot_date")
+
+        query = f"""
+            SELECT s.*,
+                public.airline_names(s.airline_ids) AS airlines,
+                array_to_string(public.airport_codes(s.layover_location_ids), ', ') AS layover_location
+            FROM {source} s"""
+        params = None
+        if days is not None:
+            query += f" WHERE {date_column} >= now() - %s * interval '1 day'"
+            params = (days,)
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        result = pd.DataFrame(cursor.fetchall(), columns=[x[0] for x in cursor.description])
+        cursor.close()
+
+        return result
+
+    def _archive_day(self, day, folder):
+        """
+        Saves the scraped rows accessed on day to a compressed parquet file in folder, returns its path.
+        Format: {table}_{YYYYMMDD}.parquet (rewritten if the rollup of day is run again).
+        """
+        query = f"""
+            SELECT * FROM {self.db_table}
+            WHERE access_date >= %s::date AND access_date < %s::date + 1;
+        """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, (day, day))
+        df = pd.DataFrame(cursor.fetchall(), columns=[x[0] for x in cursor.description])
+        cursor.close()
+
+        df["id"] = df["id"].astype(str)
+        df["layover_time"] = pd.to_numeric(df["layover_time"])
+
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+
+        filepath = os.path.join(folder, "{}_{}.parquet".format(self.db_table.split(".")[-1], day.strftime("%Y%m%d")))
+        df.to_parquet(filepath, engine="pyarrow", compression="zstd", index=False)
+        return filepath
+
+    def rollup_scraped(self, retention_days, archive_folder=None, max_days=None):
+        """
+        Retention: the scraped rows accessed more than retention_days ago are aggregated into daily
+        summaries (rollup table), then dropped from the scraped table, archived first to compressed
+        parquet files in archive_folder (if given, needs pyarrow).
+        Days are processed oldest first, each in its own transaction together with the retention state,
+        so an interrupted run resumes from the first day not rolled up yet.
+        At most max_days days are processed (if given). Returns the number of days rolled up.
+        """
+        if archive_folder:
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError("pyarrow is required to archive the scraped rows to parquet (pip install pyarrow), "
+                                  "or run the rollup without an archive folder")
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT rolled_up_until FROM public.retention_state WHERE source_table = %s;", (self.db_table,))
+        state = cursor.fetchone()
+
+        query = f"""
+            SELECT DISTINCT access_date::date FROM {self.db_table}
+            WHERE access_date < current_date - %s AND access_date >= coalesce(%s::date + 1, '-infinity')
+            ORDER BY 1;
+        """
+        cursor.execute(query, (retention_days, state[0] if state else None))
+        days = [x[0] for x in cursor.fetchall()][:max_days]
+        cursor.close()
+
+        rollup_query = f"""
+            INSERT INTO {self.rollup_table} (access_day, origin, destination, departure_datetime, arrival_datetime,
+                airline_ids, layover_n, one_way, days_advance, n_observations, price_min, price_median, price_max)
+            SELECT %(day)s::date, origin, destination, departure_datetime, arrival_datetime,
+                airline_ids, layover_n, one_way, days_advance,
+                count(*),
+                min(price_eur),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY price_eur),
+                max(price_eur)
+            FROM {self.db_table}
+            WHERE access_date >= %(day)s::date AND access_date < %(day)s::date + 1
+            GROUP BY origin, destination, departure_datetime, arrival_datetime, airline_ids, layover_n, one_way, days_advance;
+
+            DELETE FROM {self.db_table}
+            WHERE access_date >= %(day)s::date AND access_date < %(day)s::date + 1;
+
+            INSERT INTO public.retention_state (source_table, rolled_up_until, updated_at)
+            VALUES (%(table)s, %(day)s::date, now())
+            ON CONFLICT (source_table) DO UPDATE SET
+                rolled_up_until = EXCLUDED.rolled_up_until,
+                updated_at = EXCLUDED.updated_at;
+        """
+
+        n_days = 0
+        for day in days:
+            if archive_folder:
+                filepath = self._archive_day(day, archive_folder)
+                logger.info(f"Rows accessed on {day} archived to {filepath}")
+
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("BEGIN;")
+                cursor.execute(rollup_query, {"day": day, "table": self.db_table})
+                cursor.execute("COMMIT;")
+            except (Exception, psycopg2.DatabaseError) as error:
+                logger.error("Error: %s" % error)
+                cursor.execute("ROLLBACK;")
+                cursor.close()
+                break
+
+            cursor.close()
+            n_days += 1
+
+        logger.info("{} days rolled up from table [{}] to table [{}]".format(n_days, self.db_table, self.rollup_table))
+        return n_days
+
+    def enqueue_jobs(self, jobs):
+        """
+        Adds jobs (tuples origin, destination, date_leave, date_return, priority) to the job queue.
+        Jobs already pending or running are skipped. Returns the number of jobs added.
+        """
+        query = f"""
+            INSERT INTO {self.jobs_table} (origin, destination, date_leave, date_return, priority)
+            VALUES %s
+            ON CONFLICT (origin, destination, date_leave, (coalesce(date_return, '-infinity'::date)))
+                WHERE status IN ('pending', 'running')
+            DO NOTHING
+        """
+
+        cursor = self.conn.cursor()
+        extras.execute_values(cursor, query, jobs, template="(%s, %s, %s::date, %s::date, %s)")
+        n_added = cursor.rowcount
+        cursor.close()
+
+        logger.info("{} jobs added to table [{}]".format(n_added, self.jobs_table))
+        return n_added
+
+    def claim_job(self, worker_id, lease_seconds):
+        """
+        Claims the pending job with the highest priority, or a running job whose lease has expired
+        (its worker is dead), leasing it to worker_id for lease_seconds.
+        Concurrent workers never claim the same job (FOR UPDATE SKIP LOCKED).
+        Returns (id, origin, destination, date_leave, date_return), or None if there is nothing to do.
+        """
+        cursor = self.conn.cursor()
+
+        # jobs of dead workers that have no attempts left
+        cursor.execute(f"""
+            UPDATE {self.jobs_table}
+            SET status = 'failed', finished_at = now(), error = 'lease expired'
+            WHERE status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts;
+        """)
+
+        cursor.execute(f"""
+            UPDATE {self.jobs_table}
+            SET status = 'running', worker_id = %s, attempts = attempts + 1,
+                lease_expires_at = now() + %s * interval '1 second', heartbeat_at = now()
+            WHERE id = (
+                SELECT id FROM {self.jobs_table}
+                WHERE (status = 'pending' AND run_after <= now())
+                    OR (status = 'running' AND lease_expires_at < now())
+                ORDER BY priority DESC, run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, origin, destination, date_leave, date_return;
+        """, (worker_id, lease_seconds))
+        result = cursor.fetchone()
+        cursor.close()
+
+        return result
+
+    def heartbeat_job(self, job_id, worker_id, lease_seconds):
+        """
+        Extends the lease of a job. Returns False if the job is no longer leased to worker_id.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            UPDATE {self.jobs_table}
+            SET lease_expires_at = now() + %s * interval '1 second', heartbeat_at = now()
+            WHERE id = %s AND worker_id = %s AND status = 'running';
+        """, (lease_seconds, job_id, worker_id))
+        owned = cursor.rowcount == 1
+        cursor.close()
+
+        return owned
+
+    def complete_job(self, job_id, worker_id, n_results):
+        """
+        Marks a job as done. Returns False if the job is no longer leased to worker_id.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            UPDATE {self.jobs_table}
+            SET status = 'done', finished_at = now(), n_results = %s, lease_expires_at = NULL
+            WHERE id = %s AND worker_id = %s AND status = 'running';
+        """, (n_results, job_id, worker_id))
+        owned = cursor.rowcount == 1
+        cursor.close()
+
+        return owned
+
+    def fail_job(self, job_id, worker_id, error, retry_seconds):
+        """
+        Puts a failed job back in the queue (after retry_seconds), or marks it as failed
+        if it has no attempts left.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            UPDATE {self.jobs_table}
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+                run_after = now() + %s * interval '1 second',
+                lease_expires_at = NULL, error = %s
+            WHERE id = %s AND worker_id = %s AND status = 'running';
+        """, (retry_seconds, str(error), job_id, worker_id))
+        cursor.close()
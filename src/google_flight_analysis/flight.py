@@ -2,17 +2,28 @@
 # author: Emanuele Salonico, 2023
 
 from datetime import date, datetime, timedelta
-import numpy as np
-import pandas as pd
-from tqdm import tqdm
 import re
 from os import path
+import sys
 
 __all__ = ['Flight']
 
+# interned airline tuples, shared by all the flights operated by the same airlines
+_AIRLINES = {}
+
 
 class Flight:
 
+    # fixed attributes, no per-instance __dict__
+    __slots__ = (
+        '_roundtrip', '_id', '_origin', '_queried_orig', '_dest', '_queried_dest', '_date',
+        '_airline', '_flight_time', '_num_stops', '_stops', '_stops_locations', '_co2',
+        '_emissions', '_price', '_price_trend', '_time_leave', '_time_arrive', '_has_train', '_trash'
+    )
+
+    # if True, unrecognized strings are kept in Flight._trash
+    DEBUG = False
+
     def __init__(self, dl, roundtrip, queried_orig, queried_dest, price_trend, *args):
         self._roundtrip = roundtrip
         self._id = 1
@@ -21,7 +32,6 @@ class Flight:
         self._dest = None
         self._queried_dest = queried_dest
         self._date = dl
-        self._dow = datetime.strptime(dl, '%Y-%m-%d').isoweekday() # day of week
         self._airline = None
         self._flight_time = None
         self._num_stops = None
@@ -31,11 +41,10 @@ class Flight:
         self._emissions = None
         self._price = None
         self._price_trend = price_trend
-        self._times = []
         self._time_leave = None
         self._time_arrive = None
         self.has_train = False
-        self._trash = []
+        self._trash = ([] if Flight.DEBUG else None)
         self._parse_args(*args)
 
     def __repr__(self):
@@ -75,7 +84,8 @@ class Flight:
 
     @property
     def dow(self):
-        return self._dow
+        # day of week
+        return date.fromisoformat(self._date).isoweekday()
 
     @property
     def airline(self):
@@ -113,6 +123,10 @@ class Flight:
     def price_trend(self):
         return self._price_trend
 
+    @price_trend.setter
+    def price_trend(self, x : tuple) -> None:
+        self._price_trend = x
+
     @property
     def time_leave(self):
         return self._time_leave
@@ -120,6 +134,10 @@ class Flight:
     @property
     def time_arrive(self):
         return self._time_arrive
+
+    @property
+    def trash(self):
+        return self._trash
     
     @property
     def has_train(self):
@@ -130,10 +148,11 @@ class Flight:
         self._has_train = x
 
     
-    def _classify_arg(self, arg: str):
+    def _classify_arg(self, arg: str, times: list):
             """
             Classifies a string (arg) into the correct attribute for a flight,
             such as price, numer of layover stops, arrival time...
+            Departure and arrival times are collected in times.
             """
             
             # handle empty strings
@@ -149,14 +168,14 @@ class Flight:
 
             # arrival or departure time
             # regex: AM/PM (for example: 10:30AM, 4:11PM)
-            if bool(re.search("\d{1,2}\:\d{2}(?:AM|PM)\+{0,1}\d{0,1}", arg)) and (len(self._times) < 2):
+            if bool(re.search("\d{1,2}\:\d{2}(?:AM|PM)\+{0,1}\d{0,1}", arg)) and (len(times) < 2):
                 delta = timedelta(days = 0)
                 if arg[-2] == '+':
                     delta = timedelta(days = int(arg[-1]))
                     arg = arg[:-2]
 
                 date_format = "%Y-%m-%d %I:%M%p"
-                self._times += [datetime.strptime(self._date + " " + arg, date_format) + delta]
+                times += [datetime.strptime(self._date + " " + arg, date_format) + delta]
 
             # flight time       
             # regex:  3 hr 35 min, 45 min, 5 hr
@@ -188,8 +207,8 @@ class Flight:
                     self._dest = self._queried_dest
                     self._has_train = True
                 else:
-                    self._origin = arg[:3]
-                    self._dest = arg[3:]
+                    self._origin = sys.intern(arg[:3])
+                    self._dest = sys.intern(arg[3:])
 
             # layover
             # regex 1: matches "FCO, JFK, ABC, DEF", "5 min Ancona", "3 hr 13 min FCO", "FCO, JFK"
@@ -217,23 +236,24 @@ class Flight:
                 # split camel case
                 airline = re.sub('([a-z])([A-Z])', r'\1, \2', airline)
                 
-                # make it into an array (list)
-                airline = airline.split(", ")
+                # make it into an array (interned tuple)
+                airline = tuple(airline.split(", "))
         
-                self._airline = airline
+                self._airline = _AIRLINES.setdefault(airline, airline)
             
             # other (trash)
-            else:
+            elif self._trash is not None:
                 self._trash += [arg]
-                
-            # if we have both arrival and departure time, set them
-            if len(self._times) == 2:
-                self._time_leave = self._times[0]
-                self._time_arrive = self._times[1]
         
     def _parse_args(self, args):
+        times = []
         for arg in args:
-            self._classify_arg(arg)
+            self._classify_arg(arg, times)
+
+        # if we have both arrival and departure time, set them
+        if len(times) == 2:
+            self._time_leave = times[0]
+            self._time_arrive = times[1]
 
     @staticmethod
     def get_duration_in_minutes_from_string(s):
@@ -265,6 +285,8 @@ class Flight:
         """
         Generate a dataframe from lists of flight data
         """
+        import pandas as pd
+
         data = {
             'departure_datetime': [],
             'arrival_datetime': [],
@@ -309,7 +331,7 @@ class Flight:
         df['layover_time'] = df['layover_time'].apply(lambda x: Flight.get_duration_in_minutes_from_string(x))
         
         # add column: Days in Advance
-        df['days_advance'] = (df['departure_datetime'] - df['access_date']).dt.days
+        df['days_advance'] = (pd.to_datetime(df['departure_datetime']) - pd.to_datetime(df['access_date'])).dt.days
         
         return df
     
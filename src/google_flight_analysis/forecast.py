@@ -0,0 +1,184 @@
+# author: Emanuele Salonico, 2023
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pickle
+import os
+import logging
+
+# logging
+logger_name = os.path.basename(__file__)
+logger = logging.getLogger(logger_name)
+
+__all__ = ['RidgeRegressor', 'RouteModel', 'build_features', 'train_route_models', 'score', 'save_models', 'load_models']
+
+NUMERIC_FEATURES = ["days_advance", "layover_n", "price_value", "travel_time"]
+PRICE_TRENDS = ["low", "typical", "high"]
+ROUTE_COLUMNS = ["origin", "destination"]
+
+
+class RidgeRegressor:
+    """
+    Linear regression with L2 regularization, solved in closed form with numpy.
+    Follows the scikit-learn estimator interface (fit/predict).
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.coef_ = None
+        self.intercept_ = None
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # center the data, so that the intercept is not regularized
+        x_mean = X.mean(axis=0)
+        y_mean = y.mean()
+        Xc = X - x_mean
+        yc = y - y_mean
+
+        A = Xc.T @ Xc + self.alpha * np.eye(X.shape[1])
+        self.coef_ = np.linalg.solve(A, Xc.T @ yc)
+        self.intercept_ = y_mean - x_mean @ self.coef_
+
+        return self
+
+    def predict(self, X):
+        return np.asarray(X, dtype=float) @ self.coef_ + self.intercept_
+
+
+def _first_airline(airlines):
+    """
+    Returns the main (first) airline of each row as a numpy array of strings.
+    """
+    return airlines.str[0].fillna("").astype(str).to_numpy()
+
+
+def build_features(df, airlines_vocab):
+    """
+    Builds the feature matrix for the rows of df (Flight.dataframe schema), without row-wise loops:
+    numeric features, one-hot day of week of the departure, one-hot price trend
+    and one-hot main airline (limited to airlines_vocab).
+    """
+    numeric = df[NUMERIC_FEATURES].apply(pd.to_numeric, errors="coerce").fillna(0).to_numpy(dtype=float)
+
+    dow = pd.to_datetime(df["departure_datetime"]).dt.dayofweek.to_numpy()
+    dow = (dow[:, None] == np.arange(7)).astype(float)
+
+    trend = df["price_trend"].fillna("").astype(str).to_numpy()
+    trend = (trend[:, None] == np.array(PRICE_TRENDS)).astype(float)
+
+    airline = _first_airline(df["airlines"])
+    airline = (airline[:, None] == np.array(airlines_vocab, dtype=str)).astype(float)
+
+    return np.hstack([numeric, dow, trend, airline])
+
+
+class RouteModel:
+    """
+    Price model of a single route: a regressor trained on the features of its scraped flights.
+    Prices are modelled in log space.
+    """
+
+    def __init__(self, n_airlines=10, alpha=1.0):
+        self.n_airlines = n_airlines
+        self.airlines_vocab = []
+        self.x_mean = None
+        self.x_std = None
+        self.regressor = RidgeRegressor(alpha=alpha)
+
+    def _transform(self, df):
+        X = build_features(df, self.airlines_vocab)
+        return (X - self.x_mean) / self.x_std
+
+    def fit(self, df):
+        airlines = pd.Series(_first_airline(df["airlines"]))
+        self.airlines_vocab = airlines.value_counts().index[:self.n_airlines].tolist()
+
+        X = build_features(df, self.airlines_vocab)
+        self.x_mean = X.mean(axis=0)
+        self.x_std = X.std(axis=0)
+        self.x_std[self.x_std == 0] = 1
+
+        y = np.log(df["price_eur"].to_numpy(dtype=float))
+        self.regressor.fit((X - self.x_mean) / self.x_std, y)
+
+        return self
+
+    def predict(self, df):
+        return np.exp(self.regressor.predict(self._transform(df)))
+
+
+def _fit_route(route, df, n_airlines, alpha):
+    """
+    Trains the model of a single route. Returns the route, the model and the training time in seconds.
+    """
+    time_start = datetime.now()
+    model = RouteModel(n_airlines=n_airlines, alpha=alpha).fit(df)
+    time_end = datetime.now()
+
+    return route, model, (time_end - time_start).total_seconds()
+
+
+def train_route_models(df, n_jobs=None, min_rows=30, n_airlines=10, alpha=1.0):
+    """
+    Trains one model per route (origin, destination) on the scraped history in df,
+    in parallel over a process pool of n_jobs processes (n_jobs=1 trains in the current process).
+    Routes with less than min_rows valid rows are skipped.
+    Returns a tuple (models, training_times), both dictionaries keyed by route.
+    """
+    df = df.dropna(subset=["price_eur", "departure_datetime"])
+    df = df[df["price_eur"] > 0]
+
+    routes = [(route, route_df) for route, route_df in df.groupby(ROUTE_COLUMNS) if len(route_df) >= min_rows]
+
+    models = {}
+    training_times = {}
+
+    if n_jobs == 1:
+        results = [_fit_route(route, route_df, n_airlines, alpha) for route, route_df in routes]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_fit_route, route, route_df, n_airlines, alpha) for route, route_df in routes]
+            results = [future.result() for future in futures]
+
+    for route, model, seconds in results:
+        models[route] = model
+        training_times[route] = seconds
+
+    logger.info(f"{len(models)} route models trained")
+    return models, training_times
+
+
+def score(models, df):
+    """
+    Scores a batch of new scrapes: returns a copy of df with the forecast price of each flight
+    (price_forecast) and the difference between actual and forecast price (price_delta).
+    Flights of routes without a model get NaN.
+    """
+    df = df.copy()
+    df["price_forecast"] = np.nan
+
+    for route, index in df.groupby(ROUTE_COLUMNS).groups.items():
+        if route in models:
+            df.loc[index, "price_forecast"] = models[route].predict(df.loc[index])
+
+    df["price_delta"] = df["price_eur"] - df["price_forecast"]
+    return df
+
+
+def save_models(models, filepath):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.isdir(folder):
+        os.mkdir(folder)
+
+    with open(filepath, "wb") as f:
+        pickle.dump(models, f)
+
+
+def load_models(filepath):
+    with open(filepath, "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,177 @@
+# author: Emanuele Salonico, 2023
+
+from datetime import datetime, timedelta
+import json
+import re
+import os
+import logging
+
+# logging
+logger_name = os.path.basename(__file__)
+logger = logging.getLogger(logger_name)
+
+__all__ = ['HttpBackend']
+
+
+class HttpBackend:
+    """
+    Browserless backend: downloads the Google Flights page with a pooled HTTP session and
+    extracts the flight results from the data embedded in its javascript
+    (AF_initDataCallback({key: 'ds:1', ... data: [...]})), instead of the rendered text.
+
+    Layout of the embedded data (as far as it is used here):
+    data[2][0], data[3][0]: lists of itineraries ("best" and "other" flights), where each itinerary is
+        itinerary[0][1]: airline names
+        itinerary[0][2]: legs, where each leg is
+            leg[3]: departure airport, leg[6]: arrival airport,
+            leg[8]: departure time [h, m], leg[10]: arrival time [h, m],
+            leg[20]: departure date [y, m, d], leg[21]: arrival date [y, m, d]
+        itinerary[0][9]: total travel time in minutes
+        itinerary[1][0][-1]: price
+    """
+
+    HEADERS = {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
+        "Accept-Language": "en-US,en;q=0.9",
+    }
+    # pre-accepts Google's Terms & Conditions page (EU only)
+    COOKIES = {"CONSENT": "YES+"}
+
+    PAYLOAD_REGEX = re.compile(r"AF_initDataCallback\(\{key: 'ds:1',.*?data:(.*?), sideChannel: \{\}\}\);", re.DOTALL)
+    PRICE_TREND_REGEX = re.compile(r"Prices are currently[^<\"]*")
+
+    _session = None
+
+    def __init__(self, timeout=15):
+        self.timeout = timeout
+
+    @classmethod
+    def session(cls):
+        """
+        Returns the HTTP session shared by all the backends of the process (connection pooling).
+        """
+        if cls._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+            session.mount("https://", adapter)
+            session.headers.update(HttpBackend.HEADERS)
+            session.cookies.update(HttpBackend.COOKIES)
+            cls._session = session
+        return cls._session
+
+    def fetch(self, url):
+        """
+        Returns the html of a Google Flights page.
+        """
+        response = HttpBackend.session().get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    @staticmethod
+    def extract_payload(html):
+        """
+        Returns the flight data embedded in the html, or None if it cannot be found.
+        """
+        match = HttpBackend.PAYLOAD_REGEX.search(html)
+        if match is None:
+            return None
+        return json.loads(match.group(1))
+
+    @staticmethod
+    def extract_price_trend_text(html):
+        """
+        Returns the "Prices are currently ..." strings found in the html.
+        """
+        return HttpBackend.PRICE_TREND_REGEX.findall(html)[:1]
+
+    @staticmethod
+    def _to_datetime(day, time):
+        """
+        Converts the [y, m, d] and [h, m] arrays of the payload (trailing/leading nulls are omitted) to a datetime.
+        """
+        h, m = (list(time) + [None, None])[:2]
+        return datetime(*day) + timedelta(hours=h or 0, minutes=m or 0)
+
+    @staticmethod
+    def itineraries(payload):
+        """
+        Returns all the itineraries (best and other flights) of the payload.
+        """
+        results = []
+        for i in [2, 3]:
+            if len(payload) > i and isinstance(payload[i], list) and payload[i] and isinstance(payload[i][0], list):
+                results += payload[i][0]
+        return results
+
+    @staticmethod
+    def parse(html, round_trip, price_trend):
+        """
+        Returns the flights of a Google Flights page as a DataFrame (same schema as Flight.dataframe).
+        Raises ValueError if the page does not contain the embedded flight data,
+        or if the data does not have the expected layout. Flights without a price are skipped.
+        """
+        import pandas as pd
+
+        payload = HttpBackend.extract_payload(html)
+        if payload is None:
+            raise ValueError("Flight data not found in the page.")
+
+        data = {
+            'departure_datetime': [],
+            'arrival_datetime': [],
+            'airlines' : [],
+            'travel_time' : [],
+            'origin' : [],
+            'destination' : [],
+            'layover_n' : [],
+            'layover_time' : [],
+            'layover_location' : [],
+            'price_eur' : [],
+        }
+
+        n_no_price = 0
+        for itinerary in HttpBackend.itineraries(payload):
+            try:
+                info = itinerary[0]
+                legs = info[2]
+                price = (itinerary[1][0][-1] if itinerary[1] else None)
+
+                departures = [HttpBackend._to_datetime(leg[20], leg[8]) for leg in legs]
+                arrivals = [HttpBackend._to_datetime(leg[21], leg[10]) for leg in legs]
+                layovers = [int((departures[i+1] - arrivals[i]).total_seconds() // 60) for i in range(len(legs)-1)]
+            except (IndexError, TypeError, KeyError, ValueError) as e:
+                raise ValueError(f"Unexpected layout of the embedded flight data: {e!r}")
+
+            if price is None:
+                n_no_price += 1
+                continue
+
+            data['departure_datetime'] += [departures[0]]
+            data['arrival_datetime'] += [arrivals[-1]]
+            data['airlines'] += [tuple(info[1])]
+            data['travel_time'] += [info[9]]
+            data['origin'] += [legs[0][3]]
+            data['destination'] += [legs[-1][6]]
+            data['layover_n'] += [len(legs) - 1]
+            data['layover_time'] += [(sum(layovers) if layovers else None)]
+            data['layover_location'] += [(", ".join(leg[6] for leg in legs[:-1]) if layovers else None)]
+            data['price_eur'] += [price]
+
+        if n_no_price:
+            logger.info(f"{n_no_price} flights without a price skipped")
+
+        df = pd.DataFrame(data)
+        df['layover_time'] = df['layover_time'].astype(float)
+        df.insert(10, 'price_trend', price_trend[0])
+        df.insert(11, 'price_value', price_trend[1])
+        df.insert(12, 'access_date', datetime.today())
+        df.insert(13, 'one_way', not round_trip)
+        df.insert(14, 'has_train', False)
+
+        # add column: Days in Advance
+        df['days_advance'] = (pd.to_datetime(df['departure_datetime']) - pd.to_datetime(df['access_date'])).dt.days
+
+        return df
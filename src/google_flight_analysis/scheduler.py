@@ -0,0 +1,240 @@
+# author: Emanuele Salonico, 2023
+
+from datetime import date, datetime, timedelta
+import configparser
+import sqlite3
+import json
+import time
+import os
+import logging
+
+from src.google_flight_analysis.scrape import Scrape, ScrapeError
+import utils
+
+# logging
+logger_name = os.path.basename(__file__)
+logger = logging.getLogger(logger_name)
+
+__all__ = ['Scheduler']
+
+
+class Scheduler:
+    """
+    Long-running scheduler that keeps every route x departure date (a job) fresh.
+    Jobs are stored in a persistent SQLite queue. Each job is refreshed more or less often
+    depending on how close the departure is and on how much its prices have been moving
+    (volatility). The routes config file is reloaded whenever it changes.
+    """
+
+    DEFAULTS = {
+        "queue_path": "scheduler.db",
+        "refresh_hours": '{"7": 6, "30": 12, "60": 24, "365": 72}',
+        "min_refresh_hours": "2",
+        "volatility_weight": "2",
+        "retry_minutes": "30",
+        "poll_seconds": "60",
+    }
+
+    def __init__(self, config_path, on_results=None):
+        self.config_path = config_path
+        self.on_results = on_results
+        self._config_mtime = None
+        self._settings = None
+
+        self.reload_config()
+        self.conn = sqlite3.connect(self._settings["queue_path"])
+        self.create_jobs_table()
+        self.sync_jobs()
+
+    def __repr__(self):
+        return f"Scheduler: {self.config_path}"
+
+    def reload_config(self):
+        """
+        Reads the config file again if it has changed since the last read.
+        Returns True if it has been reloaded.
+        """
+        mtime = os.path.getmtime(self.config_path)
+        if mtime == self._config_mtime:
+            return False
+
+        config = configparser.ConfigParser()
+        config.read(self.config_path)
+
+        settings = dict(Scheduler.DEFAULTS)
+        if config.has_section("scheduler"):
+            settings.update(config["scheduler"])
+
+        self._settings = {
+            "queue_path": settings["queue_path"],
+            "refresh_hours": sorted((int(k), float(v)) for k, v in json.loads(settings["refresh_hours"]).items()),
+            "min_refresh_hours": float(settings["min_refresh_hours"]),
+            "volatility_weight": float(settings["volatility_weight"]),
+            "retry_minutes": float(settings["retry_minutes"]),
+            "poll_seconds": float(settings["poll_seconds"]),
+        }
+        self._backend = (config["scrape"].get("backend", "selenium") if config.has_section("scrape") else "selenium")
+        self._routes = utils.get_routes_from_config(config)
+        self._config_mtime = mtime
+
+        logger.info(f"Config loaded: {len(self._routes)} routes")
+        return True
+
+    def create_jobs_table(self):
+        query = """
+            CREATE TABLE IF NOT EXISTS jobs
+            (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                date_leave TEXT NOT NULL,
+                active INTEGER NOT NULL DEFAULT 1,
+                next_run REAL NOT NULL,
+                last_run REAL,
+                last_min_price REAL,
+                volatility REAL NOT NULL DEFAULT 0,
+                n_runs INTEGER NOT NULL DEFAULT 0,
+                n_failures INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (origin, destination, date_leave)
+            )
+        """
+        self.conn.execute(query)
+        self.conn.commit()
+
+    def sync_jobs(self):
+        """
+        Makes the jobs in the queue match the routes in the config:
+        new route x date combinations are added (due immediately), jobs of removed routes
+        and past departure dates are deactivated.
+        """
+        today = date.today()
+        wanted = set()
+        for origin, destination, n_days in self._routes:
+            for i in range(n_days):
+                wanted.add((origin, destination, (today + timedelta(days=i+1)).strftime("%Y-%m-%d")))
+
+        existing = {row[:3]: row[3] for row in self.conn.execute(
+            "SELECT origin, destination, date_leave, active FROM jobs")}
+
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO jobs (origin, destination, date_leave, next_run) VALUES (?, ?, ?, ?)",
+            [job + (now,) for job in wanted if job not in existing])
+        self.conn.executemany(
+            "UPDATE jobs SET active = 1 WHERE origin = ? AND destination = ? AND date_leave = ?",
+            [job for job in wanted if existing.get(job) == 0])
+        self.conn.executemany(
+            "UPDATE jobs SET active = 0 WHERE origin = ? AND destination = ? AND date_leave = ?",
+            [job for job, active in existing.items() if active and job not in wanted])
+        self.conn.commit()
+
+    def refresh_interval(self, date_leave, volatility):
+        """
+        Returns the refresh interval (in seconds) of a job: it depends on the number of days
+        until departure (refresh_hours setting), shortened by the volatility of its prices.
+        """
+        days_until = (datetime.strptime(date_leave, "%Y-%m-%d").date() - date.today()).days
+
+        hours = self._settings["refresh_hours"][-1][1]
+        for max_days, tier_hours in self._settings["refresh_hours"]:
+            if days_until <= max_days:
+                hours = tier_hours
+                break
+
+        hours = hours / (1 + self._settings["volatility_weight"] * volatility)
+        return max(hours, self._settings["min_refresh_hours"]) * 3600
+
+    def next_job(self):
+        """
+        Returns the due job (origin, destination, date_leave, last_min_price, volatility)
+        with the highest priority, or None if no job is due.
+        The priority of a job is how overdue it is, relative to its refresh interval
+        (on ties, the job with the shortest refresh interval, then the earliest departure, comes first).
+        """
+        now = time.time()
+        due = self.conn.execute("""
+            SELECT origin, destination, date_leave, last_min_price, volatility, next_run FROM jobs
+            WHERE active = 1 AND next_run <= ?
+        """, (now,)).fetchall()
+
+        if not due:
+            return None
+
+        def priority(job):
+            interval = self.refresh_interval(job[2], job[4])
+            return ((now - job[5]) / interval, -interval, -date.fromisoformat(job[2]).toordinal())
+
+        return max(due, key=priority)[:5]
+
+    def seconds_until_next_job(self):
+        next_run = self.conn.execute("SELECT min(next_run) FROM jobs WHERE active = 1").fetchone()[0]
+        if next_run is None:
+            return self._settings["poll_seconds"]
+        return min(max(next_run - time.time(), 0), self._settings["poll_seconds"])
+
+    def defer_job(self, key):
+        """
+        Schedules a failed job (origin, destination, date_leave) to be retried after retry_minutes.
+        """
+        next_run = time.time() + self._settings["retry_minutes"] * 60
+        self.conn.execute("""
+            UPDATE jobs SET next_run = ?, n_failures = n_failures + 1
+            WHERE origin = ? AND destination = ? AND date_leave = ?
+        """, (next_run,) + tuple(key))
+        self.conn.commit()
+
+    def run_job(self, job):
+        """
+        Scrapes a job, passes the results to on_results and schedules its next run.
+        """
+        origin, destination, date_leave, last_min_price, volatility = job
+        key = (origin, destination, date_leave)
+
+        scrape = Scrape(origin, destination, date_leave, backend=self._backend)
+        try:
+            scrape.run_scrape()
+        except ScrapeError as e:
+            logger.error(f"ERROR: {origin} {destination} {date_leave} - {e.outcome.value}")
+            self.defer_job(key)
+            return None
+
+        # volatility: exponentially weighted relative change of the cheapest price between runs
+        min_price = (None if scrape.data.empty else float(scrape.data["price_eur"].min()))
+        if min_price is not None and last_min_price:
+            volatility = 0.5 * volatility + 0.5 * abs(min_price - last_min_price) / last_min_price
+
+        now = time.time()
+        self.conn.execute("""
+            UPDATE jobs SET next_run = ?, last_run = ?, last_min_price = coalesce(?, last_min_price),
+                volatility = ?, n_runs = n_runs + 1
+            WHERE origin = ? AND destination = ? AND date_leave = ?
+        """, (now + self.refresh_interval(date_leave, volatility), now, min_price, volatility) + key)
+        self.conn.commit()
+
+        logger.info(f"Scraped: {origin} {destination} {date_leave} - {scrape.data.shape[0]} results (volatility: {round(volatility, 3)})")
+
+        if self.on_results is not None and not scrape.data.empty:
+            self.on_results(scrape.data)
+
+        return scrape.data
+
+    def run_forever(self):
+        """
+        Main loop: runs the due jobs by priority, reloading the config when it changes.
+        """
+        last_sync = date.today()
+        while True:
+            if self.reload_config() or date.today() != last_sync:
+                self.sync_jobs()
+                last_sync = date.today()
+
+            job = self.next_job()
+            if job is None:
+                time.sleep(self.seconds_until_next_job())
+                continue
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                logger.error(f"ERROR: {job[0]} {job[1]} {job[2]}")
+                logger.error(e)
+                self.defer_job(job[:3])
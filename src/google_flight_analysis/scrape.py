@@ -1,48 +1,202 @@
 # Inspired and adapted from https://pypi.org/project/google-flight-analysis/
 # author: Emanuele Salonico, 2023
 
+# selenium, webdriver_manager and requests are imported when first needed:
+# the scrape module itself stays cheap to import (replay, workers, CLI)
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 from datetime import date, datetime, timedelta
+from enum import Enum
+from queue import Queue
+import threading
 import re
 import os
-import numpy as np
-import pandas as pd
-from tqdm import tqdm
 
 from src.google_flight_analysis.flight import Flight
+from src.google_flight_analysis.http_backend import HttpBackend
 
 # logging
 logger_name = os.path.basename(__file__)
 logger = logging.getLogger(logger_name)
 
+# arrival or departure time (for example: 10:30AM, 4:11PM, 6:05AM+1)
+TIME_REGEX = re.compile(r"\d{1,2}\:\d{2}(?:AM|PM)\+{0,1}\d{0,1}")
+
+
+class Outcome(Enum):
+    """
+    Possible outcomes of a single Google Flights page request.
+    """
+    OK = "ok"
+    NO_FLIGHTS = "no_flights"
+    CONSENT_WALL = "consent_wall"
+    LAYOUT_CHANGED = "layout_changed"
+    TIMEOUT = "timeout"
+
+
+class ScrapeError(Exception):
+    """
+    Raised when a page request ends with a failure outcome.
+    Carries the outcome and, when available, the raw page text (list of lines).
+    """
+
+    def __init__(self, outcome, message="", page_text=None):
+        super().__init__(f"[{outcome.value}] {message}".strip())
+        self.outcome = outcome
+        self.page_text = page_text
+
 
 class Scrape:
 
-    def __init__(self, orig, dest, date_leave, date_return=None, export=False):
+    # how many times a failure outcome is retried (reusing the same driver)
+    RETRIES = {
+        Outcome.OK: 0,
+        Outcome.NO_FLIGHTS: 0,
+        Outcome.CONSENT_WALL: 2,
+        Outcome.LAYOUT_CHANGED: 1,
+        Outcome.TIMEOUT: 2,
+    }
+
+    # text shown by Google Flights when a search has no results
+    NO_FLIGHTS_MARKERS = ("No results returned", "No options matching your search", "There are no flights")
+
+    # folder where the raw text of failed pages is saved for later replay
+    CAPTURE_FOLDER = "captures"
+
+    # "http": browserless backend (HttpBackend), with selenium as fallback
+    BACKENDS = ("selenium", "http")
+
+    def __init__(self, orig, dest, date_leave, date_return=None, export=False, capture=True, backend="selenium"):
+        if backend not in Scrape.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+
         self._origin = orig
         self._dest = dest
         self._date_leave = date_leave
         self._date_return = date_return
         self._round_trip = (True if date_return is not None else False)
         self._export = export
+        self._capture = capture
+        self._backend = backend
         self._data = None
         self._url = None
+        self._outcome = None
+        self._attempts = 0
 
     def run_scrape(self):
         self._data = self._scrape_data()
+        self._export_data()
 
-        if self._export:
+    def _export_data(self):
+        if self._export and not self._data.empty:
             Flight.export_to_csv(self._data, self._origin,
                                  self._dest, self._date_leave, self._date_return)
 
+    @staticmethod
+    def run_pipelined(scrapes, queue_size=2):
+        """
+        Runs many scrapes with a single driver, as a pipeline: while the text of page N is parsed
+        on a worker thread, the driver is already loading page N+1 (at most queue_size pages wait
+        to be parsed). Pages that fail are retried on the same driver once the pipeline is done.
+        Returns a list of (scrape, error) tuples in the same order as scrapes, error being None on success.
+        As in a sequential run, an error only fails its own scrape; the driver is recreated if it fails.
+        """
+        errors = {}
+        retry = []
+        pages = Queue(maxsize=queue_size)
+
+        def parse_pages():
+            while True:
+                item = pages.get()
+                if item is None:
+                    return
+                scrape, results = item
+                try:
+                    scrape._data = scrape._parse_page(results)
+                    scrape._outcome = Outcome.OK
+                    scrape._export_data()
+                except ScrapeError as e:
+                    scrape._outcome = e.outcome
+                    scrape._capture_page(e)
+                    retry.append((scrape, e.outcome))
+                except Exception as e:
+                    errors[id(scrape)] = e
+
+        parser = threading.Thread(target=parse_pages, daemon=True)
+        parser.start()
+
+        def quit_driver(driver):
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning(f"Could not quit the driver: {e}")
+
+        driver = None
+        try:
+            for scrape in scrapes:
+                try:
+                    scrape._url = scrape._make_url()
+
+                    if scrape._backend == "http":
+                        import requests
+                        try:
+                            scrape._data = scrape._scrape_data_http()
+                            scrape._export_data()
+                            continue
+                        except (ScrapeError, ValueError, requests.RequestException) as e:
+                            logger.warning(f"HTTP backend failed ({e}), falling back to selenium: {scrape._origin} {scrape._dest} {scrape._date_leave}")
+
+                    if driver is None:
+                        driver = scrape.create_driver()
+
+                    scrape._attempts += 1
+                    results = scrape._fetch_page(driver)
+                except ScrapeError as e:
+                    scrape._outcome = e.outcome
+                    if e.outcome == Outcome.NO_FLIGHTS:
+                        scrape._data = Flight.dataframe([])
+                    else:
+                        scrape._capture_page(e)
+                        retry.append((scrape, e.outcome))
+                    continue
+                except Exception as e:
+                    # the driver may be dead (e.g. WebDriverException): start a new one for the next scrape
+                    errors[id(scrape)] = e
+                    if driver is not None:
+                        quit_driver(driver)
+                        driver = None
+                    continue
+
+                # blocks while the parser is queue_size pages behind
+                pages.put((scrape, results))
+
+            pages.put(None)
+            parser.join()
+
+            # failed pages, with the usual retry policy (the failure above counts as the first one)
+            for scrape, outcome in retry:
+                if Scrape.RETRIES[outcome] == 0:
+                    errors[id(scrape)] = ScrapeError(outcome, "No retries left.")
+                    continue
+                try:
+                    if driver is None:
+                        driver = scrape.create_driver()
+                    scrape._data = scrape._get_results(driver, failures={outcome: 1})
+                    scrape._export_data()
+                except ScrapeError as e:
+                    errors[id(scrape)] = e
+                except Exception as e:
+                    errors[id(scrape)] = e
+                    if driver is not None:
+                        quit_driver(driver)
+                        driver = None
+        finally:
+            if parser.is_alive():
+                pages.put(None)
+            if driver is not None:
+                quit_driver(driver)
+
+        return [(scrape, errors.get(id(scrape))) for scrape in scrapes]
+
     def __str__(self):
         if self._date_return is None:
             return "{dl}: {org} --> {dest}".format(
@@ -123,7 +277,24 @@ class Scrape:
     def url(self):
         return self._url
 
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def outcome(self):
+        return self._outcome
+
+    @property
+    def attempts(self):
+        return self._attempts
+
     def create_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+
         options = Options()
         options.add_argument('--no-sandbox')
         options.add_argument('--headless')
@@ -139,10 +310,45 @@ class Scrape:
         """
         Scrapes the Google Flights page and returns a DataFrame of the results.
         """
-        driver = self.create_driver()
         self._url = self._make_url()
-        flight_results = self._get_results(driver)
-        driver.quit()
+
+        if self._backend == "http":
+            import requests
+            try:
+                return self._scrape_data_http()
+            except (ScrapeError, ValueError, requests.RequestException) as e:
+                logger.warning(f"HTTP backend failed ({e}), falling back to selenium: {self._origin} {self._dest} {self._date_leave}")
+
+        driver = self.create_driver()
+        try:
+            flight_results = self._get_results(driver)
+        finally:
+            driver.quit()
+
+        return flight_results
+
+    def _scrape_data_http(self):
+        """
+        Scrapes the Google Flights page without a browser (see HttpBackend) and returns a DataFrame of the results.
+        """
+        self._attempts += 1
+        html = HttpBackend().fetch(self._url)
+
+        if Scrape._identify_google_terms_page(html):
+            raise ScrapeError(Outcome.CONSENT_WALL, "Could not get past Google's Terms & Conditions page.")
+
+        price_trend = Scrape.extract_price_trend(HttpBackend.extract_price_trend_text(html))
+        try:
+            flight_results = HttpBackend.parse(html, self._round_trip, price_trend)
+        except ValueError as e:
+            raise ScrapeError(Outcome.LAYOUT_CHANGED, str(e))
+
+        if flight_results.empty:
+            if not any(marker in html for marker in Scrape.NO_FLIGHTS_MARKERS):
+                raise ScrapeError(Outcome.LAYOUT_CHANGED, "No flights found in the embedded page data.")
+            self._outcome = Outcome.NO_FLIGHTS
+        else:
+            self._outcome = Outcome.OK
 
         return flight_results
 
@@ -164,78 +370,183 @@ class Scrape:
                 date_leave=self._date_leave
             )
 
-    def _get_results(self, driver):
+    def _get_results(self, driver, failures=None):
         """
         Returns the scraped flight results as a DataFrame.
+        Failed attempts are retried on the same driver according to Scrape.RETRIES
+        (failures: number of failures already counted, per outcome);
+        a search without flights returns an empty DataFrame right away.
         """
-        results = None
+        failures = dict(failures or {})
+        while True:
+            self._attempts += 1
+            try:
+                results = self._fetch_page(driver)
+                flight_results = self._parse_page(results)
+                self._outcome = Outcome.OK
+                return flight_results
+
+            except ScrapeError as e:
+                self._outcome = e.outcome
+                if e.outcome == Outcome.NO_FLIGHTS:
+                    logger.info(f"No flights found: {self._origin} {self._dest} {self._date_leave}")
+                    return Flight.dataframe([])
+
+                self._capture_page(e)
+                failures[e.outcome] = failures.get(e.outcome, 0) + 1
+                if failures[e.outcome] > Scrape.RETRIES[e.outcome]:
+                    raise
+
+                logger.warning(f"{e} - retry {failures[e.outcome]}/{Scrape.RETRIES[e.outcome]}: {self._origin} {self._dest} {self._date_leave}")
+
+    def _fetch_page(self, driver):
+        """
+        Returns the raw text lines of the results page, or raises a ScrapeError
+        describing why they could not be obtained.
+        """
+        from selenium.common.exceptions import TimeoutException
+
         try:
-            results = Scrape._make_url_request(self._url, driver)
+            return Scrape._make_url_request(self._url, driver)
         except TimeoutException:
-            logger.error(f"Scrape timeout reached. It could mean that no flights exist for the combination of airports and dates." )
-            return -1
+            page_text = Scrape._get_page_text(driver)
+            if Scrape._identify_google_terms_page(driver.page_source):
+                raise ScrapeError(Outcome.CONSENT_WALL, "Could not get past Google's Terms & Conditions page.", page_text)
+            raise ScrapeError(Outcome.TIMEOUT, "Scrape timeout reached.", page_text)
 
+    def _parse_page(self, results):
+        """
+        Turns the raw text lines of a results page into a DataFrame of flights.
+        """
         flights = self._clean_results(results)
         return Flight.dataframe(flights)
 
-    def _clean_results(self, result):
+    def _capture_page(self, error):
         """
-        Cleans and organizes the raw text strings scraped from the Google Flights results page.
+        Saves the raw page text of a failed attempt to disk, so it can be replayed later.
+        Format:
+        {access_date_YYMMDD}_{access_time_HHMMSS}_{orig}_{dest}_{leave_date}_{return_date|oneway}_{outcome}.txt
         """
-        res2 = [x.encode("ascii", "ignore").decode().strip() for x in result]
+        if not self._capture or not error.page_text:
+            return
 
-        price_trend_dirty = [
-            x for x in res2 if x.startswith("Prices are currently")]
-        price_trend = Scrape.extract_price_trend(price_trend_dirty)
+        if not os.path.isdir(Scrape.CAPTURE_FOLDER):
+            os.mkdir(Scrape.CAPTURE_FOLDER)
 
-        start = res2.index("Sort by:")+1
+        filename = "{access}_{org}_{dest}_{dl}_{dr}_{outcome}.txt".format(
+            access=datetime.now().strftime("%y%m%d_%H%M%S"),
+            org=self._origin,
+            dest=self._dest,
+            dl=self._date_leave,
+            dr=(self._date_return if self._date_return else "oneway"),
+            outcome=error.outcome.value)
 
-        try:
-            mid_start = res2.index("Price insights")
-        except ValueError:
-            mid_start = res2.index("Other flights")
-        mid_end = -1
+        full_filepath = os.path.join(Scrape.CAPTURE_FOLDER, filename)
+        with open(full_filepath, "w", encoding="utf-8") as f:
+            f.write("\n".join(error.page_text))
 
-        try:
-            mid_end = res2.index("Other departing flights")+1
-        except:
-            mid_end = res2.index("Other flights")+1
-
-        end = [i for i, x in enumerate(res2) if x.endswith('more flights')][0]
-
-        res3 = res2[start:mid_start] + res2[mid_end:end]
+        logger.info(f"Page captured: {full_filepath}")
 
-        matches = []
-        # Enumerate over the list 'res3'
-        for index, element in enumerate(res3):
-
-            # Check if the length of the element is more than 2
-            if len(element) <= 2:
-                continue
-
-            # Check if the element ends with 'AM' or 'PM' (or AM+, PM+)
-            is_time_format = bool(
-                re.search("\d{1,2}\:\d{2}(?:AM|PM)\+{0,1}\d{0,1}", element))
+    @classmethod
+    def replay(cls, filepath):
+        """
+        Runs the parsing step again on a page captured by a failed scrape
+        and returns the resulting Scrape object (no browser needed).
+        """
+        filename = os.path.splitext(os.path.basename(filepath))[0]
+        _, _, orig, dest, date_leave, date_return, _ = filename.split("_", 6)
 
-            # If the element doesn't end with '+' and is in time format, then add it to the matches list
-            if (element[-2] != '+' and is_time_format):
-                matches.append(index)
+        scrape = cls(orig, dest, date_leave, (None if date_return == "oneway" else date_return), capture=False)
+        with open(filepath, encoding="utf-8") as f:
+            results = f.read().split("\n")
 
-        # Keep only every second item in the matches list
-        matches = matches[::2]
+        scrape._data = scrape._parse_page(results)
+        scrape._outcome = Outcome.OK
+        return scrape
 
+    def _clean_results(self, result):
+        """
+        Cleans and organizes the raw text strings scraped from the Google Flights results page.
+        """
+        price_trend_text = []
         flights = [
             Flight(
                 self._date_leave,  # date_leave
                 self._round_trip,  # round_trip
                 self._origin,
                 self._dest,
-                price_trend,
-                res3[matches[i]:matches[i+1]]) for i in range(len(matches)-1)
+                None,  # price trend, set below
+                tokens) for tokens in Scrape._segment_flights(result, price_trend_text)
         ]
 
+        # the price trend is usually found after the first flights
+        price_trend = Scrape.extract_price_trend(price_trend_text)
+        for flight in flights:
+            flight.price_trend = price_trend
+
+        if not flights:
+            outcome = Scrape.classify_page(x.encode("ascii", "ignore").decode() for x in result) or Outcome.LAYOUT_CHANGED
+            raise ScrapeError(outcome, "No flights could be parsed from the results page.", result)
+
         return flights
 
+    @staticmethod
+    def _segment_flights(result, price_trend_text):
+        """
+        Single pass over the raw lines of the results page, yielding the strings of one flight at a time.
+        State machine:
+        HEADER: until "Sort by:"
+        FLIGHTS: a flight starts at a time string (departure), once the current one has both its times;
+                 "Price insights" --> INSIGHTS, "... more flights" --> DONE
+        INSIGHTS: skipped until "Other departing flights" (or "Other flights") --> FLIGHTS
+        The first "Prices are currently ..." string is appended to price_trend_text.
+        """
+        state = "HEADER"
+        flight = []
+        n_times = 0
+
+        for line in result:
+            x = line.encode("ascii", "ignore").decode().strip()
+
+            if not price_trend_text and x.startswith("Prices are currently"):
+                price_trend_text.append(x)
+
+            if state == "HEADER":
+                if x == "Sort by:":
+                    state = "FLIGHTS"
+
+            elif state == "FLIGHTS":
+                if x == "Price insights" or x.endswith("more flights"):
+                    if n_times:
+                        yield flight
+                    flight, n_times = [], 0
+                    state = ("INSIGHTS" if x == "Price insights" else "DONE")
+
+                elif x in ("Other departing flights", "Other flights"):
+                    continue
+
+                elif len(x) > 2 and TIME_REGEX.search(x):
+                    if n_times == 2:
+                        yield flight
+                        flight, n_times = [], 0
+                    flight.append(x)
+                    n_times += 1
+
+                # strings before the first time of a section are headers
+                elif n_times:
+                    flight.append(x)
+
+            elif state == "INSIGHTS":
+                if x in ("Other departing flights", "Other flights"):
+                    state = "FLIGHTS"
+
+            # DONE: only looking for the price trend
+            elif price_trend_text:
+                break
+
+        if state == "FLIGHTS" and n_times:
+            yield flight
+
     @staticmethod
     def extract_price_trend(s):
         """
@@ -271,12 +582,29 @@ class Scrape:
             return True
         return False
 
+    @staticmethod
+    def classify_page(lines):
+        """
+        Returns the failure Outcome of a page from its text lines (consent wall or no flights),
+        or None if the page does not look like a known failure.
+        """
+        for line in lines:
+            if Scrape._identify_google_terms_page(line):
+                return Outcome.CONSENT_WALL
+            if any(marker in line for marker in Scrape.NO_FLIGHTS_MARKERS):
+                return Outcome.NO_FLIGHTS
+        return None
+
     @staticmethod
     def _make_url_request(url, driver):
         """
         Get raw results from Google Flights page.
         Also handles auto acceptance of Google's Terms & Conditions page.
         """
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.common.by import By
+
         timeout = 15
         driver.get(url)
 
@@ -289,16 +617,42 @@ class Scrape:
             WebDriverWait(driver, timeout).until(EC.element_to_be_clickable(
                 (By.XPATH, "//button[contains(., 'Accept all')]"))).click()
 
-        # wait for flight data to load and initial XPATH cleaning
+        # wait for flight data (or a "no flights" message) to load and initial XPATH cleaning
         WebDriverWait(driver, timeout).until(
-            lambda d: len(Scrape._get_flight_elements(d)) > 100)
+            lambda d: Scrape._results_loaded(Scrape._get_page_text(d)))
         results = Scrape._get_flight_elements(driver)
 
+        if Scrape.classify_page(results) == Outcome.NO_FLIGHTS:
+            raise ScrapeError(Outcome.NO_FLIGHTS, "No flights found.", results)
+
         return results
 
+    @staticmethod
+    def _results_loaded(lines):
+        """
+        Returns True once the page shows either flight results or a "no flights" message.
+        """
+        return len(lines) > 100 or Scrape.classify_page(lines) == Outcome.NO_FLIGHTS
+
+    @staticmethod
+    def _get_page_text(driver):
+        """
+        Returns the text lines of the whole page body, or an empty list if it is not available.
+        Unlike _get_flight_elements, it does not expect the results page layout.
+        """
+        from selenium.common.exceptions import WebDriverException
+        from selenium.webdriver.common.by import By
+
+        try:
+            return driver.find_element(by=By.TAG_NAME, value="body").text.split('\n')
+        except WebDriverException:
+            return []
+
     @staticmethod
     def _get_flight_elements(driver):
         """
         Returns all html elements that contain/have to do with flight data.
         """
+        from selenium.webdriver.common.by import By
+
         return driver.find_element(by=By.XPATH, value='//body[@id = "yDmH0d"]').text.split('\n')
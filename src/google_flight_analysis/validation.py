@@ -0,0 +1,72 @@
+# author: Emanuele Salonico, 2023
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import os
+import logging
+
+# logging
+logger_name = os.path.basename(__file__)
+logger = logging.getLogger(logger_name)
+
+__all__ = ['validate_scraped', 'write_quarantine_file']
+
+# constraints of the scraped table
+NOT_NULL_COLUMNS = ["travel_time", "origin", "destination", "layover_n", "price_eur",
+                    "access_date", "one_way", "has_train", "days_advance"]
+SMALLINT_COLUMNS = ["travel_time", "layover_n", "layover_time", "price_eur", "days_advance"]
+CHAR3_COLUMNS = ["origin", "destination"]
+SMALLINT_MIN, SMALLINT_MAX = -32768, 32767
+
+QUARANTINE_FOLDER = "quarantine"
+
+
+def validate_scraped(df, not_null_columns=()):
+    """
+    Checks the rows of df (Flight.dataframe schema) against the constraints of the scraped table
+    (plus not_null_columns), with vectorized masks (no row-wise loops).
+    Returns a tuple (valid_df, invalid_df), invalid_df having an extra "reason" column
+    listing the violated constraints of each row.
+    """
+    checks = []
+
+    for col in NOT_NULL_COLUMNS + list(not_null_columns):
+        checks.append((df[col].isna().to_numpy(), f"{col} is null"))
+
+    for col in SMALLINT_COLUMNS:
+        values = pd.to_numeric(df[col], errors="coerce")
+        out_of_range = ((values < SMALLINT_MIN) | (values > SMALLINT_MAX)).to_numpy()
+        not_a_number = (values.isna() & df[col].notna()).to_numpy()
+        checks.append((out_of_range | not_a_number, f"{col} is not a smallint"))
+
+    for col in CHAR3_COLUMNS:
+        checks.append(((df[col].notna() & (df[col].astype(str).str.len() != 3)).to_numpy(), f"{col} is not a 3 letters code"))
+
+    reasons = np.full(len(df), "", dtype=object)
+    for mask, reason in checks:
+        reasons[mask] = reasons[mask] + reason + "; "
+
+    invalid = reasons != ""
+    invalid_df = df[invalid].copy()
+    invalid_df["reason"] = [x[:-2] for x in reasons[invalid]]
+
+    if invalid.any():
+        logger.warning(f"{invalid.sum()} invalid rows (out of {len(df)})")
+
+    return df[~invalid], invalid_df
+
+
+def write_quarantine_file(invalid_df, folder=QUARANTINE_FOLDER):
+    """
+    Saves invalid rows to a csv file in the quarantine folder, returns its path.
+    Format: {access_date_YYMMDD}_{access_time_HHMMSS}_quarantine.csv
+    """
+    if not os.path.isdir(folder):
+        os.mkdir(folder)
+
+    filepath = os.path.join(folder, datetime.now().strftime("%y%m%d_%H%M%S") + "_quarantine.csv")
+    invalid_df.to_csv(filepath, index=False)
+
+    logger.info(f"{len(invalid_df)} invalid rows saved to {filepath}")
+    return filepath
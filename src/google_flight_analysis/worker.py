@@ -0,0 +1,124 @@
+# author: Emanuele Salonico, 2023
+
+from datetime import date, timedelta
+import threading
+import socket
+import time
+import os
+import logging
+
+from src.google_flight_analysis.scrape import Scrape, ScrapeError
+
+# logging
+logger_name = os.path.basename(__file__)
+logger = logging.getLogger(logger_name)
+
+__all__ = ['Worker', 'jobs_from_routes']
+
+
+def jobs_from_routes(routes):
+    """
+    Returns the jobs (origin, destination, date_leave, date_return, priority) of a list of routes
+    ([origin, destination, range_of_days_from_today]). Closer departures get a higher priority:
+    the priority is minus the days until departure, so that jobs compare the same way across routes.
+    """
+    today = date.today()
+    jobs = []
+    for origin, destination, n_days in routes:
+        for i in range(n_days):
+            jobs.append((origin, destination, (today + timedelta(days=i+1)).strftime("%Y-%m-%d"), None, -(i+1)))
+    return jobs
+
+
+class Worker:
+    """
+    Scraping worker for distributed runs: claims route x date jobs from the job queue in the database,
+    scrapes them and writes the results back. Any number of workers, on any number of hosts, can run
+    against the same database. While a job runs, a heartbeat thread keeps its lease alive: jobs of
+    dead workers are reclaimed by other workers once their lease expires.
+    """
+
+    def __init__(self, db, on_results, worker_id=None, lease_seconds=180, heartbeat_seconds=30,
+                 retry_seconds=600, backend="selenium"):
+        self.db = db
+        self.on_results = on_results
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.retry_seconds = retry_seconds
+        self.backend = backend
+
+    def __repr__(self):
+        return f"Worker: {self.worker_id}"
+
+    def _heartbeat(self, job_id, stop, lost):
+        while not stop.wait(self.heartbeat_seconds):
+            if not self.db.heartbeat_job(job_id, self.worker_id, self.lease_seconds):
+                logger.warning(f"Lease lost for job {job_id}")
+                lost.set()
+                return
+
+    def run_job(self, job):
+        """
+        Scrapes a claimed job and writes its results, keeping its lease alive meanwhile.
+        """
+        job_id, origin, destination, date_leave, date_return = job
+        date_leave = date_leave.strftime("%Y-%m-%d")
+        date_return = (date_return.strftime("%Y-%m-%d") if date_return else None)
+
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop, lost), daemon=True)
+        heartbeat.start()
+
+        try:
+            scrape = Scrape(origin, destination, date_leave, date_return, backend=self.backend)
+            scrape.run_scrape()
+        except Exception as e:
+            stop.set()
+            heartbeat.join()
+            error = (e.outcome.value if isinstance(e, ScrapeError) else e)
+            logger.error(f"ERROR: job {job_id} {origin} {destination} {date_leave} - {error}")
+            self.db.fail_job(job_id, self.worker_id, error, self.retry_seconds)
+            return None
+
+        stop.set()
+        heartbeat.join()
+
+        # another worker took over the job: drop the results, it will write its own
+        if lost.is_set() or not self.db.heartbeat_job(job_id, self.worker_id, self.lease_seconds):
+            logger.warning(f"Results of job {job_id} dropped, lease lost")
+            return None
+
+        try:
+            if not scrape.data.empty:
+                self.on_results(scrape.data)
+        except Exception as e:
+            logger.error(f"ERROR: job {job_id} {origin} {destination} {date_leave} - results not written: {e}")
+            self.db.fail_job(job_id, self.worker_id, e, self.retry_seconds)
+            return None
+
+        self.db.complete_job(job_id, self.worker_id, scrape.data.shape[0])
+
+        logger.info(f"[{self.worker_id}] Scraped: {origin} {destination} {date_leave} - {scrape.data.shape[0]} results")
+        return scrape.data
+
+    def run(self, max_jobs=None, idle_seconds=30, stop_when_empty=False):
+        """
+        Main loop: claims and runs jobs until max_jobs have run (if given),
+        or until the queue is empty (if stop_when_empty).
+        Returns the number of jobs run.
+        """
+        n_jobs = 0
+        while max_jobs is None or n_jobs < max_jobs:
+            job = self.db.claim_job(self.worker_id, self.lease_seconds)
+            if job is None:
+                if stop_when_empty:
+                    break
+                time.sleep(idle_seconds)
+                continue
+
+            self.run_job(job)
+            n_jobs += 1
+
+        return n_jobs
@@ -0,0 +1,34 @@
+import os
+import sys
+import subprocess
+
+from tests.test_scrape_outcome import read_fixture
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY_MODULES = ["pandas", "numpy", "selenium", "webdriver_manager", "tqdm", "requests", "psycopg2", "private.private"]
+
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, "flight_analysis.py", *args], cwd=ROOT, capture_output=True, text=True)
+
+
+def test_no_heavy_imports_at_start():
+    code = "import flight_analysis, sys; print([x for x in %r if x in sys.modules])" % HEAVY_MODULES
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().split("\n")[-1] == "[]"
+
+
+def test_help():
+    result = run_cli("--help")
+    assert result.returncode == 0
+    for command in ["scrape", "load", "replay", "report", "migrate", "schedule", "worker", "enqueue"]:
+        assert command in result.stdout
+
+
+def test_replay(tmp_path):
+    capture = tmp_path / "230601_101500_MUC_FCO_2023-06-04_oneway_layout_changed.txt"
+    capture.write_text("\n".join(read_fixture()), encoding="utf-8")
+
+    result = run_cli("replay", str(capture))
+    assert result.returncode == 0
+    assert result.stdout.count("MUC") >= 5
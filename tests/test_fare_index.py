@@ -0,0 +1,25 @@
+import pandas as pd
+
+from src.google_flight_analysis.database import Database
+
+
+def make_df():
+    # accessed at 22:00, departure 6 days and 8 hours later (7 calendar days)
+    return pd.DataFrame({
+        "origin": ["MUC"],
+        "destination": ["FCO"],
+        "departure_datetime": [pd.Timestamp("2023-06-08 06:00")],
+        "access_date": [pd.Timestamp("2023-06-01 22:00")],
+        "days_advance": [6],
+    })
+
+
+def test_fare_index_keys():
+    keys = Database.fare_index_keys(make_df())
+    assert keys.to_dict("records") == [{"origin": "MUC", "destination": "FCO",
+                                        "departure_date": pd.Timestamp("2023-06-08").date(), "days_advance_bucket": 0}]
+
+
+def test_fare_index_keys_calendar_days():
+    keys = Database.fare_index_keys(make_df(), calendar_days=True)
+    assert keys["days_advance_bucket"].tolist() == [7]
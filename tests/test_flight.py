@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from src.google_flight_analysis.flight import Flight
+from src.google_flight_analysis.scrape import Scrape
+from tests.test_scrape_outcome import read_fixture
+
+
+def parse_fixture():
+    return Scrape("MUC", "FCO", "2023-06-04")._clean_results(read_fixture())
+
+
+def test_no_instance_dict():
+    flight = parse_fixture()[0]
+    assert not hasattr(flight, "__dict__")
+
+
+def test_airlines_interned():
+    flights_a, flights_b = parse_fixture(), parse_fixture()
+    assert flights_a[2].airline == ("Lufthansa", "Swiss")
+    for a, b in zip(flights_a, flights_b):
+        assert a.airline is b.airline
+
+
+def test_trash_only_in_debug(monkeypatch):
+    assert all(flight.trash is None for flight in parse_fixture())
+
+    monkeypatch.setattr(Flight, "DEBUG", True)
+    assert all(isinstance(flight.trash, list) for flight in parse_fixture())
+
+
+def test_dow():
+    for flight in parse_fixture():
+        assert flight.dow == datetime.strptime("2023-06-04", "%Y-%m-%d").isoweekday()
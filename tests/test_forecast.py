@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from src.google_flight_analysis import forecast
+
+
+def make_df(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    days_advance = rng.integers(1, 90, n)
+    layover_n = rng.integers(0, 3, n)
+    return pd.DataFrame({
+        "departure_datetime": pd.Timestamp("2023-06-01") + pd.to_timedelta(rng.integers(0, 30, n), unit="D"),
+        "airlines": [["Lufthansa"] if x else ["ITA", "KLM"] for x in rng.integers(0, 2, n)],
+        "travel_time": 90 + 120 * layover_n,
+        "origin": "MUC",
+        "destination": "FCO",
+        "layover_n": layover_n,
+        "price_eur": 100 + 30 * layover_n + days_advance,
+        "price_trend": "typical",
+        "price_value": None,
+        "days_advance": days_advance,
+    })
+
+
+def test_ridge_regressor():
+    X = np.arange(20, dtype=float).reshape(10, 2)
+    y = X @ np.array([1.0, 2.0]) + 3
+    model = forecast.RidgeRegressor(alpha=0).fit(X[:, :1], y)
+    assert np.allclose(model.predict(X[:, :1]), y)
+
+
+def test_train_and_score():
+    df = make_df()
+    models, training_times = forecast.train_route_models(df, n_jobs=1)
+    assert list(models) == [("MUC", "FCO")]
+    assert training_times[("MUC", "FCO")] >= 0
+
+    scored = forecast.score(models, df)
+    assert scored["price_forecast"].notna().all()
+    assert (scored["price_delta"].abs() / scored["price_eur"]).mean() < 0.1
+
+
+def test_score_unknown_route():
+    df = make_df(n=50)
+    models, _ = forecast.train_route_models(df, n_jobs=1)
+    scored = forecast.score(models, df.assign(destination="JFK"))
+    assert scored["price_forecast"].isna().all()
@@ -0,0 +1,64 @@
+import os
+import pytest
+import pandas as pd
+
+from src.google_flight_analysis.scrape import Scrape, ScrapeError, Outcome
+from src.google_flight_analysis.http_backend import HttpBackend
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(filename):
+    with open(os.path.join(FIXTURES, filename), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parse_embedded_data():
+    df = HttpBackend.parse(read_fixture("muc_fco_results.html"), False, ("typical", None))
+    assert df.shape[0] == 5
+    assert df.loc[2, "airlines"] == ("Lufthansa", "Swiss")
+    assert df.loc[2, "layover_location"] == "ZRH"
+    assert df.loc[3, "layover_time"] == 415
+    assert df.loc[3, "arrival_datetime"] == pd.Timestamp("2023-06-05 08:10")
+    assert df.loc[4, "departure_datetime"] == pd.Timestamp("2023-06-04 17:00")
+
+
+def test_same_schema_as_selenium_backend():
+    lines = read_fixture("muc_fco_results.txt").split("\n")
+    selenium_df = Scrape("MUC", "FCO", "2023-06-04")._parse_page(lines)
+    http_df = HttpBackend.parse(read_fixture("muc_fco_results.html"), False, ("typical", None))
+    assert list(http_df.columns) == list(selenium_df.columns)
+
+
+def test_scrape_http_backend(monkeypatch):
+    monkeypatch.setattr(HttpBackend, "fetch", lambda self, url: read_fixture("muc_fco_results.html"))
+    scrape_obj = Scrape("MUC", "FCO", "2023-06-04", backend="http")
+    scrape_obj.run_scrape()
+    assert scrape_obj.outcome == Outcome.OK
+    assert scrape_obj.data.shape[0] == 5
+    assert (scrape_obj.data["price_trend"] == "typical").all()
+
+
+def test_missing_embedded_data():
+    with pytest.raises(ValueError):
+        HttpBackend.parse("<html><body>Before you continue to Google</body></html>", False, (None, None))
+
+
+def test_flights_without_price_skipped():
+    html = read_fixture("muc_fco_results.html").replace('[[null,132],"token"]', '[[null,null],"token"]')
+    df = HttpBackend.parse(html, False, ("typical", None))
+    assert df.shape[0] == 4
+    assert df["price_eur"].notna().all()
+
+
+def test_unexpected_layout(monkeypatch):
+    html = read_fixture("muc_fco_results.html").replace("[2023,6,4],[2023,6,4]", "null,null", 1)
+    with pytest.raises(ValueError):
+        HttpBackend.parse(html, False, ("typical", None))
+
+    monkeypatch.setattr(HttpBackend, "fetch", lambda self, url: html)
+    scrape_obj = Scrape("MUC", "FCO", "2023-06-04", backend="http")
+    scrape_obj._url = scrape_obj._make_url()
+    with pytest.raises(ScrapeError) as e:
+        scrape_obj._scrape_data_http()
+    assert e.value.outcome == Outcome.LAYOUT_CHANGED
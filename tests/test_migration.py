@@ -0,0 +1,37 @@
+import pytest
+
+from src.google_flight_analysis.database import Database
+
+# needs a local Postgres, configured in private/private.py
+private = pytest.importorskip("private.private")
+
+
+@pytest.fixture
+def db():
+    db = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table="public.scraped_migration_test")
+    db.create_dimension_tables()
+
+    cursor = db.conn.cursor()
+    cursor.execute(f"""
+        DROP TABLE IF EXISTS {db.db_table};
+        CREATE TABLE {db.db_table} (airlines text[], layover_location text, price_eur smallint);
+        INSERT INTO {db.db_table} VALUES ('{{Lufthansa, Swiss}}', 'ZRH', 120), ('{{ITA}}', NULL, 90);
+    """)
+    yield db
+
+    cursor.execute(f"DROP TABLE IF EXISTS {db.db_table};")
+    cursor.close()
+
+
+def test_migrate_legacy_table(db):
+    assert db.db_table in db.legacy_tables()
+    assert db.migrate_to_dimension_ids(db.db_table)
+    assert db.db_table not in db.legacy_tables()
+
+    cursor = db.conn.cursor()
+    cursor.execute(f"""
+        SELECT public.airline_names(airline_ids), public.airport_codes(layover_location_ids)
+        FROM {db.db_table} ORDER BY price_eur DESC;
+    """)
+    assert cursor.fetchall() == [(["Lufthansa", "Swiss"], ["ZRH"]), (["ITA"], None)]
+    cursor.close()
@@ -0,0 +1,78 @@
+import pytest
+from datetime import datetime, timedelta
+
+from src.google_flight_analysis.database import Database
+
+# needs a local Postgres, configured in private/private.py
+private = pytest.importorskip("private.private")
+
+
+@pytest.fixture
+def db():
+    db = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table="public.scraped_retention_test")
+    db.rollup_table = "public.scraped_rollup_daily_test"
+
+    cursor = db.conn.cursor()
+    db.create_dimension_tables()
+    db.create_scraped_table(overwrite=False)
+    cursor.execute(f"""
+        DROP TABLE IF EXISTS {db.db_table};
+        CREATE TABLE {db.db_table} (LIKE public.scraped INCLUDING ALL);
+        DELETE FROM public.retention_state WHERE source_table = '{db.db_table}';
+    """)
+    db.create_rollup_tables(overwrite=True)
+    yield db
+
+    cursor.execute(f"""
+        DROP TABLE IF EXISTS {db.db_table};
+        DROP TABLE IF EXISTS {db.rollup_table};
+        DELETE FROM public.retention_state WHERE source_table = '{db.db_table}';
+    """)
+    cursor.close()
+
+
+def add_rows(db, access_date, prices):
+    departure = access_date + timedelta(days=30)
+    cursor = db.conn.cursor()
+    for price in prices:
+        cursor.execute(f"""
+            INSERT INTO {db.db_table} (departure_datetime, arrival_datetime, airline_ids, travel_time, origin, destination,
+                layover_n, price_eur, access_date, one_way, has_train, days_advance)
+            VALUES (%s, %s, '{{1}}', 120, 'MUC', 'FCO', 0, %s, %s, true, false, 30);
+        """, (departure, departure + timedelta(hours=2), price, access_date))
+    cursor.close()
+
+
+def count(db, table):
+    cursor = db.conn.cursor()
+    cursor.execute(f"SELECT count(*) FROM {table};")
+    result = cursor.fetchone()[0]
+    cursor.close()
+    return result
+
+
+def test_rollup_old_rows(db):
+    old = datetime.now().replace(hour=12) - timedelta(days=400)
+    add_rows(db, old, [100, 120, 200])
+    add_rows(db, old + timedelta(days=1), [90])
+    add_rows(db, datetime.now(), [150])
+
+    assert db.rollup_scraped(365) == 2
+    assert count(db, db.db_table) == 1
+    assert count(db, db.rollup_table) == 2
+
+    cursor = db.conn.cursor()
+    cursor.execute(f"SELECT n_observations, price_min, price_median, price_max FROM {db.rollup_table} ORDER BY access_day;")
+    assert cursor.fetchone() == (3, 100, 120, 200)
+    cursor.close()
+
+
+def test_rollup_resumes(db):
+    old = datetime.now().replace(hour=12) - timedelta(days=400)
+    add_rows(db, old, [100])
+    add_rows(db, old + timedelta(days=1), [90])
+
+    assert db.rollup_scraped(365, max_days=1) == 1
+    assert db.rollup_scraped(365) == 1
+    assert db.rollup_scraped(365) == 0
+    assert count(db, db.rollup_table) == 2
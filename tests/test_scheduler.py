@@ -0,0 +1,42 @@
+from datetime import date, timedelta
+
+from src.google_flight_analysis.scheduler import Scheduler
+
+
+def make_scheduler(tmp_path, routes):
+    config_path = tmp_path / "config.ini"
+    config_path.write_text(
+        "[routes]\n" + "\n".join(f"r{i} = {route}" for i, route in enumerate(routes)) +
+        f"\n\n[scheduler]\nqueue_path = {tmp_path / 'scheduler.db'}\n")
+    return Scheduler(str(config_path)), config_path
+
+
+def n_active_jobs(scheduler):
+    return scheduler.conn.execute("SELECT count(*) FROM jobs WHERE active = 1").fetchone()[0]
+
+
+def test_sync_jobs(tmp_path):
+    scheduler, config_path = make_scheduler(tmp_path, ['["MUC", "FCO", 3]', '["FCO", "MUC", 2]'])
+    assert n_active_jobs(scheduler) == 5
+
+    # hot reload: a removed route deactivates its jobs
+    config_path.write_text(f"[routes]\nr0 = [\"MUC\", \"FCO\", 3]\n\n[scheduler]\nqueue_path = {tmp_path / 'scheduler.db'}\n")
+    scheduler._config_mtime = None
+    assert scheduler.reload_config()
+    scheduler.sync_jobs()
+    assert n_active_jobs(scheduler) == 3
+
+
+def test_refresh_interval(tmp_path):
+    scheduler, _ = make_scheduler(tmp_path, ['["MUC", "FCO", 1]'])
+    near = (date.today() + timedelta(days=2)).strftime("%Y-%m-%d")
+    far = (date.today() + timedelta(days=90)).strftime("%Y-%m-%d")
+
+    assert scheduler.refresh_interval(near, 0) < scheduler.refresh_interval(far, 0)
+    assert scheduler.refresh_interval(far, 0.5) < scheduler.refresh_interval(far, 0)
+
+
+def test_next_job_prefers_near_departures(tmp_path):
+    scheduler, _ = make_scheduler(tmp_path, ['["MUC", "FCO", 90]'])
+    job = scheduler.next_job()
+    assert job[2] == (date.today() + timedelta(days=1)).strftime("%Y-%m-%d")
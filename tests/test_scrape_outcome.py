@@ -0,0 +1,143 @@
+import os
+import pytest
+import pandas as pd
+
+from src.google_flight_analysis.scrape import Scrape, ScrapeError, Outcome
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "muc_fco_results.txt")
+
+
+def read_fixture():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return f.read().split("\n")
+
+
+def test_parse_results_page():
+    scrape_obj = Scrape("MUC", "FCO", "2023-06-04")
+    df = scrape_obj._parse_page(read_fixture())
+    assert isinstance(df, pd.DataFrame)
+    assert df.shape[0] > 0
+    assert (df["origin"] == "MUC").all()
+
+
+def test_layout_changed():
+    lines = [x for x in read_fixture() if x != "Sort by:"]
+    with pytest.raises(ScrapeError) as e:
+        Scrape("MUC", "FCO", "2023-06-04")._parse_page(lines)
+    assert e.value.outcome == Outcome.LAYOUT_CHANGED
+
+
+def test_classify_page():
+    assert Scrape.classify_page(["Flights", "No results returned."]) == Outcome.NO_FLIGHTS
+    assert Scrape.classify_page(["Before you continue to Google"]) == Outcome.CONSENT_WALL
+    assert Scrape.classify_page(read_fixture()) is None
+
+
+def test_retry_policy(monkeypatch):
+    calls = []
+
+    def fetch_page(outcome):
+        def _fetch_page(self, driver):
+            calls.append(outcome)
+            raise ScrapeError(outcome, page_text=["page"])
+        return _fetch_page
+
+    # real no-flights results are not retried
+    monkeypatch.setattr(Scrape, "_fetch_page", fetch_page(Outcome.NO_FLIGHTS))
+    scrape_obj = Scrape("MUC", "FCO", "2023-06-04", capture=False)
+    assert scrape_obj._get_results(driver=None).empty
+    assert scrape_obj.outcome == Outcome.NO_FLIGHTS
+    assert len(calls) == 1
+
+    # timeouts are retried on the same driver, then raised
+    calls.clear()
+    monkeypatch.setattr(Scrape, "_fetch_page", fetch_page(Outcome.TIMEOUT))
+    scrape_obj = Scrape("MUC", "FCO", "2023-06-04", capture=False)
+    with pytest.raises(ScrapeError):
+        scrape_obj._get_results(driver=None)
+    assert len(calls) == Scrape.RETRIES[Outcome.TIMEOUT] + 1
+
+
+def test_replay_capture(tmp_path):
+    capture = tmp_path / "230601_101500_MUC_FCO_2023-06-04_oneway_layout_changed.txt"
+    capture.write_text("\n".join(read_fixture()), encoding="utf-8")
+
+    scrape_obj = Scrape.replay(str(capture))
+    assert scrape_obj.origin == "MUC"
+    assert scrape_obj.date_return is None
+    assert scrape_obj.outcome == Outcome.OK
+    assert scrape_obj.data.shape[0] > 0
+
+
+def test_run_pipelined(monkeypatch):
+    class FakeDriver:
+        def quit(self):
+            self.closed = True
+
+    driver = FakeDriver()
+    monkeypatch.setattr(Scrape, "create_driver", lambda self: driver)
+
+    def fetch_page(self, driver):
+        if self.dest == "JFK":
+            raise ScrapeError(Outcome.NO_FLIGHTS)
+        if self.dest == "LAX":
+            return ["Sort by:", "nothing here"]
+        return read_fixture()
+
+    monkeypatch.setattr(Scrape, "_fetch_page", fetch_page)
+
+    scrapes = [Scrape("MUC", dest, "2023-06-04", capture=False) for dest in ["FCO", "JFK", "FCO", "LAX", "FCO"]]
+    results = Scrape.run_pipelined(scrapes, queue_size=1)
+
+    assert [scrape for scrape, _ in results] == scrapes
+    assert [error is None for _, error in results] == [True, True, True, False, True]
+    assert scrapes[0].data.shape[0] > 0 and scrapes[4].outcome == Outcome.OK
+    assert scrapes[1].data.empty and scrapes[1].outcome == Outcome.NO_FLIGHTS
+    assert scrapes[3].outcome == Outcome.LAYOUT_CHANGED
+    assert scrapes[3].attempts == Scrape.RETRIES[Outcome.LAYOUT_CHANGED] + 1
+    assert driver.closed
+
+
+def test_run_pipelined_isolates_errors(monkeypatch):
+    class FakeDriver:
+        closed = False
+
+        def quit(self):
+            self.closed = True
+
+    drivers = []
+
+    def create_driver(self):
+        drivers.append(FakeDriver())
+        return drivers[-1]
+
+    def fetch_page(self, driver):
+        if self.dest == "JFK":
+            raise OSError("connection reset")
+        return read_fixture()
+
+    monkeypatch.setattr(Scrape, "create_driver", create_driver)
+    monkeypatch.setattr(Scrape, "_fetch_page", fetch_page)
+
+    scrapes = [Scrape("MUC", dest, "2023-06-04", capture=False) for dest in ["FCO", "JFK", "FCO"]]
+    results = Scrape.run_pipelined(scrapes)
+
+    assert [error is None for _, error in results] == [True, False, True]
+    assert isinstance(results[1][1], OSError)
+    assert scrapes[0].data.shape[0] > 0 and scrapes[2].data.shape[0] > 0
+    assert len(drivers) == 2 and all(x.closed for x in drivers)
+
+
+def test_segment_flights():
+    price_trend_text = []
+    groups = list(Scrape._segment_flights(read_fixture(), price_trend_text))
+    assert len(groups) == 5
+    assert groups[3][:3] == ["10:30PM", "", "8:10AM+1"]
+    assert price_trend_text == ["Prices are currently typical"]
+
+
+def test_segment_flights_missing_markers():
+    lines = [x for x in read_fixture() if x not in ("Price insights", "Other departing flights") and not x.endswith("more flights")]
+    df = Scrape("MUC", "FCO", "2023-06-04")._parse_page(lines)
+    assert df.shape[0] == 5
+    assert (df["price_trend"] == "typical").all()
@@ -0,0 +1,41 @@
+import os
+import pandas as pd
+
+from src.google_flight_analysis.http_backend import HttpBackend
+from src.google_flight_analysis.validation import validate_scraped
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "muc_fco_results.html")
+
+
+def make_df():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return HttpBackend.parse(f.read(), False, ("typical", None))
+
+
+def test_valid_rows():
+    valid_df, invalid_df = validate_scraped(make_df())
+    assert valid_df.shape[0] == 5
+    assert invalid_df.empty
+
+
+def test_invalid_rows():
+    df = make_df()
+    df["travel_time"] = df["travel_time"].astype(object)
+    df.loc[1, "travel_time"] = None
+    df.loc[1, "layover_n"] = None
+    df.loc[3, "price_eur"] = 100000
+    df.loc[4, "origin"] = "MUNICH"
+
+    valid_df, invalid_df = validate_scraped(df)
+    assert list(valid_df.index) == [0, 2]
+    assert list(invalid_df.index) == [1, 3, 4]
+    assert invalid_df.loc[1, "reason"] == "travel_time is null; layover_n is null"
+    assert invalid_df.loc[3, "reason"] == "price_eur is not a smallint"
+    assert invalid_df.loc[4, "reason"] == "origin is not a 3 letters code"
+
+
+def test_extra_not_null_columns():
+    df = make_df()
+    df.loc[0, "arrival_datetime"] = pd.NaT
+    valid_df, invalid_df = validate_scraped(df, not_null_columns=["arrival_datetime"])
+    assert list(invalid_df.index) == [0]
@@ -0,0 +1,58 @@
+import pytest
+from datetime import date, timedelta
+
+from src.google_flight_analysis.database import Database
+
+# needs a local Postgres, configured in private/private.py
+private = pytest.importorskip("private.private")
+
+
+@pytest.fixture
+def db():
+    db = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table=private.DB_TABLE)
+    db.jobs_table = "public.scrape_jobs_test"
+    db.create_jobs_table(overwrite=True)
+    yield db
+
+    cursor = db.conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {db.jobs_table};")
+    cursor.close()
+
+
+def make_db(db):
+    other = Database(db_host=private.DB_HOST, db_name=private.DB_NAME, db_user=private.DB_USER, db_pw=private.DB_PW, db_table=private.DB_TABLE)
+    other.jobs_table = db.jobs_table
+    return other
+
+
+def test_enqueue_skips_open_jobs(db):
+    day = (date.today() + timedelta(days=10)).strftime("%Y-%m-%d")
+    assert db.enqueue_jobs([("MUC", "FCO", day, None, 1), ("FCO", "MUC", day, None, 1)]) == 2
+    assert db.enqueue_jobs([("MUC", "FCO", day, None, 1)]) == 0
+
+
+def test_workers_claim_distinct_jobs(db):
+    day = (date.today() + timedelta(days=10)).strftime("%Y-%m-%d")
+    db.enqueue_jobs([("MUC", "FCO", day, None, 1), ("FCO", "MUC", day, None, 2)])
+
+    other = make_db(db)
+    job_a = db.claim_job("worker-a", 60)
+    job_b = other.claim_job("worker-b", 60)
+
+    assert job_a[1] == "FCO"  # highest priority first
+    assert job_a[0] != job_b[0]
+    assert db.claim_job("worker-a", 60) is None
+
+    assert db.complete_job(job_a[0], "worker-a", 10)
+    assert not other.complete_job(job_a[0], "worker-b", 10)
+
+
+def test_expired_lease_is_reclaimed(db):
+    day = (date.today() + timedelta(days=10)).strftime("%Y-%m-%d")
+    db.enqueue_jobs([("MUC", "FCO", day, None, 1)])
+
+    job = db.claim_job("dead-worker", 0)
+    reclaimed = make_db(db).claim_job("worker-b", 60)
+
+    assert reclaimed[0] == job[0]
+    assert not db.heartbeat_job(job[0], "dead-worker", 60)
@@ -0,0 +1,16 @@
+from datetime import date, timedelta
+
+from src.google_flight_analysis.worker import jobs_from_routes
+
+
+def test_jobs_from_routes():
+    jobs = jobs_from_routes([["MUC", "FCO", 3]])
+    assert [x[2] for x in jobs] == [(date.today() + timedelta(days=i)).strftime("%Y-%m-%d") for i in [1, 2, 3]]
+
+
+def test_jobs_priority_across_routes():
+    jobs = jobs_from_routes([["MUC", "FCO", 90], ["FCO", "MUC", 2]])
+    far = [x for x in jobs if x[0] == "MUC"][-1]
+    tomorrow = [x for x in jobs if x[0] == "FCO"][0]
+    assert tomorrow[4] > far[4]
+    assert max(jobs, key=lambda x: x[4])[2] == tomorrow[2]